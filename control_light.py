@@ -25,6 +25,9 @@ BRMESH_SERVICE_UUID = "0000fff0-0000-1000-8000-00805f9b34fb"
 BRMESH_WRITE_CHAR = "0000fff3-0000-1000-8000-00805f9b34fb"  # Write characteristic
 BRMESH_NOTIFY_CHAR = "0000fff4-0000-1000-8000-00805f9b34fb"  # Notify characteristic
 
+# BRMesh manufacturer ID in either byte order (0xfff0 == 65520, 0xf0ff == 61695)
+BRMESH_MFR_IDS = frozenset({0xfff0, 0xf0ff})
+
 async def find_brmesh_devices():
     """Scan for BRMesh devices"""
     logger.info("🔍 Scanning for BRMesh devices...")
@@ -40,10 +43,8 @@ async def find_brmesh_devices():
             
             # Check manufacturer data (0xfff0, 0xf0ff, etc.)
             if advertisement_data.manufacturer_data:
-                for mfr_id in advertisement_data.manufacturer_data.keys():
-                    if mfr_id in [0xfff0, 0xf0ff, 61695, 65520]:
-                        is_brmesh = True
-                        break
+                if advertisement_data.manufacturer_data.keys() & BRMESH_MFR_IDS:
+                    is_brmesh = True
             
             # Check service UUIDs
             if advertisement_data.service_uuids:
@@ -4,10 +4,20 @@ Extended scan to find specific BRMesh device
 """
 
 import asyncio
+from dataclasses import dataclass
 from bleak import BleakScanner
 
 TARGET_MAC = "4E:5F:6B:1C:34:8E"  # Device with a88b in pairing data
 
+@dataclass(slots=True)
+class DevInfo:
+    """Advertisement snapshot of a scanned device"""
+    name: str
+    rssi: int
+    manufacturer_data: dict
+    service_uuids: list
+
+
 async def scan():
     print("=" * 70)
     print("🔍 Extended BLE Device Scan")
@@ -24,12 +34,12 @@ async def scan():
         mac = device.address.upper()
         
         if mac not in devices:
-            devices[mac] = {
-                'name': device.name or 'Unknown',
-                'rssi': ad_data.rssi,
-                'manufacturer_data': ad_data.manufacturer_data,
-                'service_uuids': ad_data.service_uuids or []
-            }
+            devices[mac] = DevInfo(
+                name=device.name or 'Unknown',
+                rssi=ad_data.rssi,
+                manufacturer_data=ad_data.manufacturer_data,
+                service_uuids=ad_data.service_uuids or []
+            )
             
             is_target = (mac == TARGET_MAC.upper())
             marker = "⭐ TARGET!" if is_target else ""
@@ -70,8 +80,8 @@ async def scan():
         print("")
         print("Devices with 'fff' service UUIDs (likely BRMesh):")
         for mac, info in devices.items():
-            if any('fff' in uuid.lower() for uuid in info['service_uuids']):
-                print(f"   {mac} - {info['name']} (RSSI: {info['rssi']})")
+            if any('fff' in uuid.lower() for uuid in info.service_uuids):
+                print(f"   {mac} - {info.name} (RSSI: {info.rssi})")
 
 if __name__ == "__main__":
     asyncio.run(scan())
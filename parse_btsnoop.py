@@ -3,127 +3,208 @@
 Parse btsnoop_hci.log to extract BRMesh device MAC addresses and advertisement data
 """
 
+import mmap
 import struct
 import sys
+from collections import Counter
 
-def parse_btsnoop(filename):
-    """Parse Android btsnoop_hci.log format"""
+# Packet record header: orig len, incl len, flags, drops, timestamp
+_REC_HDR = struct.Struct('>IIIIQ')
+_REC_HDR_SIZE = _REC_HDR.size
+_U16_LE = struct.Struct('<H')
+
+# HCI Event packet indicator + LE Meta Event code
+_LE_META_PREFIX = b'\x04\x3E'
+
+def _parse_ad(buf, start, end):
+    """Return (mfr_id, payload) for each Manufacturer Specific AD structure in buf[start:end]
+
+    Works on offsets into the packet so only matching payloads get sliced. Kept
+    free of dict/device bookkeeping so it can be swapped for a compiled
+    implementation without touching the record loop.
+    """
+    entries = []
+    i = start
+    while i < end:
+        length = buf[i]
+        if length == 0 or i + length + 1 > end:
+            break
+        
+        # 0xFF = Manufacturer Specific Data (type byte + 2-byte company ID)
+        if buf[i + 1] == 0xFF and length >= 3:
+            mfr_id = _U16_LE.unpack_from(buf, i + 2)[0]
+            entries.append((mfr_id, buf[i + 4:i + 1 + length]))
+        
+        i += length + 1
     
-    devices = {}
+    return entries
+
+
+def _iter_records(mv):
+    """Walk the packet records of a mapped btsnoop file, yielding each advertising report
+
+    Yields (mac, mfr_id, payload, rssi), with mfr_id/payload set to None when the
+    report carries no BRMesh sized manufacturer data. Returns the packet count.
+    """
     packet_count = 0
+    pos = 16  # Skip file header
+    size = len(mv)
     
-    with open(filename, 'rb') as f:
-        # Read file header
-        # Format: "btsnoop\0" + version (4 bytes) + data link type (4 bytes)
-        header = f.read(16)
-        if not header.startswith(b'btsnoop\x00'):
-            print("❌ Not a valid btsnoop file!")
-            return devices
+    # Read packet records
+    while True:
+        # Packet record header: 24 bytes
+        # - Original length (4 bytes)
+        # - Included length (4 bytes)
+        # - Flags (4 bytes)
+        # - Cumulative drops (4 bytes)
+        # - Timestamp (8 bytes)
+        if pos + _REC_HDR_SIZE > size:
+            break  # End of file
         
-        print(f"✅ Valid btsnoop file")
-        print(f"   Version: {struct.unpack('>I', header[8:12])[0]}")
-        print()
+        orig_len, incl_len, flags, drops, timestamp_us = _REC_HDR.unpack_from(mv, pos)
+        pos += _REC_HDR_SIZE
         
-        # Read packet records
-        while True:
-            # Packet record header: 24 bytes
-            # - Original length (4 bytes)
-            # - Included length (4 bytes)
-            # - Flags (4 bytes)
-            # - Cumulative drops (4 bytes)
-            # - Timestamp (8 bytes)
-            record_header = f.read(24)
-            
-            if len(record_header) < 24:
-                break  # End of file
-            
-            orig_len, incl_len, flags, drops = struct.unpack('>IIII', record_header[:16])
-            timestamp_us = struct.unpack('>Q', record_header[16:24])[0]
+        # Packet data (zero-copy view into the mapped file)
+        if pos + incl_len > size:
+            break
+        packet_data = mv[pos:pos + incl_len]
+        pos += incl_len
+        
+        packet_count += 1
+        
+        # Parse HCI packets
+        # We're looking for: HCI Event (0x04), LE Meta Event (0x3E), Advertising Report (0x02)
+        # Cheapest test first: most records aren't LE meta events at all
+        if packet_data[:2] != _LE_META_PREFIX:
+            continue
+        if len(packet_data) < 4 or packet_data[3] != 0x02:  # LE Advertising Report
+            continue
+        
+        # Parse LE Advertising Report
+        try:
+            offset = 4  # Start of report data
+            num_reports = packet_data[offset]
+            offset += 1
             
-            # Read packet data
-            packet_data = f.read(incl_len)
-            if len(packet_data) < incl_len:
-                break
+            for _ in range(num_reports):
+                if offset + 8 > len(packet_data):
+                    break
+                
+                event_type = packet_data[offset]
+                addr_type = packet_data[offset + 1]
+                # MAC address (6 bytes, little-endian)
+                mac_bytes = packet_data[offset + 2:offset + 8]
+                mac = bytes(mac_bytes[::-1]).hex(':').upper()
+                offset += 8
+                
+                # AD data length
+                if offset >= len(packet_data):
+                    break
+                ad_len = packet_data[offset]
+                offset += 1
+                
+                # AD data, parsed in place further down
+                if offset + ad_len > len(packet_data):
+                    break
+                ad_start = offset
+                offset += ad_len
+                
+                # RSSI
+                if offset >= len(packet_data):
+                    break
+                # Signed byte, decoded without a slice + struct round trip
+                rssi = packet_data[offset]
+                if rssi & 0x80:
+                    rssi -= 256
+                offset += 1
+                
+                # Parse AD structures
+                mfr_id = payload = None
+                for ad_mfr_id, mfr_payload in _parse_ad(packet_data, ad_start, ad_start + ad_len):
+                    # BRMesh uses 16 or 24 byte manufacturer data (only one fits
+                    # in a legacy advertisement)
+                    if len(mfr_payload) in [16, 24]:
+                        mfr_id = ad_mfr_id
+                        payload = bytes(mfr_payload)  # Must not pin the mapped file
+                        break
+                
+                yield mac, mfr_id, payload, rssi
+        except Exception as e:
+            pass
+    
+    return packet_count
+
+
+def iter_advertising_reports(filename):
+    """Stream LE advertising reports out of an Android btsnoop_hci.log
+
+    Yields (mac, mfr_id, payload, rssi) per report without holding the capture in
+    memory. The generator's return value is the packet count, or None if the file
+    is not a btsnoop capture.
+    """
+    with open(filename, 'rb') as f:
+        # Map the whole capture instead of issuing a read() per record
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file can't be mapped
+            print("❌ Not a valid btsnoop file!")
+            return None
+        
+        try:
+            # Read file header
+            # Format: "btsnoop\0" + version (4 bytes) + data link type (4 bytes)
+            header = mm[:16]
+            if not header.startswith(b'btsnoop\x00'):
+                print("❌ Not a valid btsnoop file!")
+                return None
             
-            packet_count += 1
+            print(f"✅ Valid btsnoop file")
+            print(f"   Version: {struct.unpack('>I', header[8:12])[0]}")
+            print()
             
-            # Parse HCI packets
-            # We're looking for: HCI Event (0x04), LE Meta Event (0x3E), Advertising Report (0x02)
-            if len(packet_data) > 0 and packet_data[0] == 0x04:  # HCI Event
-                if len(packet_data) > 2 and packet_data[1] == 0x3E:  # LE Meta Event
-                    if len(packet_data) > 3 and packet_data[3] == 0x02:  # LE Advertising Report
-                        # Parse LE Advertising Report
-                        try:
-                            offset = 4  # Start of report data
-                            num_reports = packet_data[offset]
-                            offset += 1
-                            
-                            for _ in range(num_reports):
-                                if offset + 8 > len(packet_data):
-                                    break
-                                
-                                event_type = packet_data[offset]
-                                addr_type = packet_data[offset + 1]
-                                # MAC address (6 bytes, little-endian)
-                                mac_bytes = packet_data[offset + 2:offset + 8]
-                                mac = ':'.join(f'{b:02X}' for b in reversed(mac_bytes))
-                                offset += 8
-                                
-                                # AD data length
-                                if offset >= len(packet_data):
-                                    break
-                                ad_len = packet_data[offset]
-                                offset += 1
-                                
-                                # AD data
-                                if offset + ad_len > len(packet_data):
-                                    break
-                                ad_data = packet_data[offset:offset + ad_len]
-                                offset += ad_len
-                                
-                                # RSSI
-                                if offset >= len(packet_data):
-                                    break
-                                rssi = struct.unpack('b', packet_data[offset:offset + 1])[0]
-                                offset += 1
-                                
-                                # Track device
-                                if mac not in devices:
-                                    devices[mac] = {
-                                        'packets': 0,
-                                        'rssi': rssi,
-                                        'mfr_data': []
-                                    }
-                                devices[mac]['packets'] += 1
-                                devices[mac]['rssi'] = rssi
-                                
-                                # Parse AD structures
-                                i = 0
-                                while i < len(ad_data):
-                                    if i >= len(ad_data):
-                                        break
-                                    length = ad_data[i]
-                                    if length == 0 or i + length + 1 > len(ad_data):
-                                        break
-                                    
-                                    ad_type = ad_data[i + 1]
-                                    ad_value = ad_data[i + 2:i + 1 + length]
-                                    
-                                    # 0xFF = Manufacturer Specific Data
-                                    if ad_type == 0xFF and len(ad_value) >= 2:
-                                        mfr_id = struct.unpack('<H', ad_value[0:2])[0]
-                                        mfr_payload = ad_value[2:]
-                                        
-                                        # BRMesh uses 16 or 24 byte manufacturer data
-                                        if len(mfr_payload) in [16, 24]:
-                                            devices[mac]['mfr_data'].append({
-                                                'mfr_id': mfr_id,
-                                                'data': mfr_payload.hex()
-                                            })
-                                    
-                                    i += length + 1
-                        except Exception as e:
-                            pass
+            # Packet views must be gone before the map can be closed, so they
+            # only live inside the _iter_records frame
+            with memoryview(mm) as mv:
+                packet_count = yield from _iter_records(mv)
+        finally:
+            mm.close()
+    
+    return packet_count
+
+
+def parse_btsnoop(filename):
+    """Parse Android btsnoop_hci.log format"""
+    
+    devices = {}
+    devices_get = devices.get
+    
+    reports = iter_advertising_reports(filename)
+    while True:
+        try:
+            mac, mfr_id, payload, rssi = next(reports)
+        except StopIteration as done:
+            packet_count = done.value
+            break
+        
+        # Track device (one dict lookup per report)
+        info = devices_get(mac)
+        if info is None:
+            info = devices[mac] = {
+                'packets': 0,
+                'rssi': rssi,
+                'mfr_data': Counter()
+            }
+        info['packets'] += 1
+        info['rssi'] = rssi
+        
+        # Devices repeat the same blob for the whole capture; keep one entry
+        # per distinct payload along with how often it was seen
+        if payload is not None:
+            info['mfr_data'][(mfr_id, payload)] += 1
+    
+    if packet_count is None:
+        return devices
     
     print(f"📊 Parsed {packet_count} HCI packets")
     print(f"📡 Found {len(devices)} unique BLE devices")
@@ -145,32 +226,31 @@ if __name__ == "__main__":
     print("=" * 70)
     
     if brmesh_devices:
+        # Build the per-device report up front and emit it with a single write
+        out = []
         for mac, info in brmesh_devices.items():
-            print(f"\n📍 MAC: {mac}")
-            print(f"   RSSI: {info['rssi']} dBm")
-            print(f"   Packets captured: {info['packets']}")
-            
-            # Show unique manufacturer data
-            unique_data = {}
-            for mfr in info['mfr_data']:
-                key = (mfr['mfr_id'], len(mfr['data'])//2)
-                if key not in unique_data:
-                    unique_data[key] = mfr['data']
+            out.append(f"\n📍 MAC: {mac}")
+            out.append(f"   RSSI: {info['rssi']} dBm")
+            out.append(f"   Packets captured: {info['packets']}")
             
-            for (mfr_id, data_len), data_hex in unique_data.items():
-                print(f"\n   Manufacturer ID: 0x{mfr_id:04x}")
-                print(f"   Data length: {data_len} bytes")
-                print(f"   Data: {data_hex}")
+            # Show unique manufacturer data, most frequent first
+            for (mfr_id, data_bytes), copies in info['mfr_data'].most_common():
+                data_len = len(data_bytes)
+                out.append(f"\n   Manufacturer ID: 0x{mfr_id:04x}")
+                out.append(f"   Data length: {data_len} bytes")
+                out.append(f"   Data: {data_bytes.hex()}")
+                out.append(f"   Seen: {copies}x")
                 
                 # Decode if it's a pairing packet (16 bytes)
                 if data_len == 16:
-                    data_bytes = bytes.fromhex(data_hex)
-                    print(f"   🔓 PAIRING PACKET!")
-                    print(f"      MAC in packet: {':'.join(f'{b:02X}' for b in data_bytes[0:6])}")
-                    print(f"      Address: {data_bytes[6]}")
-                    print(f"      Constant: {data_bytes[7]}")
-                    print(f"      🔑 MESH KEY: {data_bytes[8:12].hex()}")
-                    print(f"         ASCII: '{data_bytes[8:12].decode('ascii', errors='replace')}'")
+                    out.append(f"   🔓 PAIRING PACKET!")
+                    out.append(f"      MAC in packet: {data_bytes[0:6].hex(':').upper()}")
+                    out.append(f"      Address: {data_bytes[6]}")
+                    out.append(f"      Constant: {data_bytes[7]}")
+                    out.append(f"      🔑 MESH KEY: {data_bytes[8:12].hex()}")
+                    out.append(f"         ASCII: '{data_bytes[8:12].decode('ascii', errors='replace')}'")
+        out.append('')
+        sys.stdout.write('\n'.join(out))
         
         print("\n" + "=" * 70)
         print("✅ Found your BRMesh lights!")
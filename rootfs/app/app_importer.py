@@ -10,6 +10,17 @@ from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+# SharedPreferences XML entries
+_PREFS_MESH_KEY_RE = re.compile(r'<string name="mesh_key">(\w+)</string>')
+_PREFS_DEV_RE = re.compile(r'<string name="device_(\d+)">([^<]+)</string>')
+
+# Defaults for lights added by an import (nested containers are created per light)
+_DEFAULT_LIGHT = {
+    'device_type': 'bulb',
+    'color_interlock': True,
+}
+_IMPORTED_LIGHT_KEYS = ('name', 'device_type', 'state')
+
 class BRMeshAppImporter:
     """
     Import configuration from BRMesh Android app
@@ -129,26 +140,31 @@ class BRMeshAppImporter:
         }
         
         # Parse XML for mesh key
-        mesh_key_pattern = r'<string name="mesh_key">(\w+)</string>'
-        mesh_match = re.search(mesh_key_pattern, prefs_xml)
+        mesh_match = _PREFS_MESH_KEY_RE.search(prefs_xml)
         if mesh_match:
             config['mesh_key'] = mesh_match.group(1)
         
         # Parse device list (format varies by app version)
-        device_pattern = r'<string name="device_(\d+)">([^<]+)</string>'
-        for match in re.finditer(device_pattern, prefs_xml):
+        for match in _PREFS_DEV_RE.finditer(prefs_xml):
             device_id = int(match.group(1))
             device_data = match.group(2)
             
-            # Parse device data (usually JSON string)
-            try:
-                device_json = json.loads(device_data)
+            # Parse device data (usually JSON string) - only attempt a decode
+            # when it looks like a JSON object, raising is expensive
+            device_json = None
+            if device_data.startswith('{') and device_data.endswith('}'):
+                try:
+                    device_json = json.loads(device_data)
+                except (ValueError, json.JSONDecodeError):
+                    pass
+            
+            if device_json is not None:
                 config['devices'].append({
                     'device_id': device_id,
                     'name': device_json.get('name', f'Light {device_id}'),
                     'type': device_json.get('type', 'RGBW')
                 })
-            except:
+            else:
                 # Fallback if not JSON
                 config['devices'].append({
                     'device_id': device_id,
@@ -218,31 +234,31 @@ class BRMeshAppImporter:
                 self.bridge.mesh_key = imported_config['mesh_key']
             
             # Add/update devices
+            lights = self.bridge.lights
             for device in imported_config.get('devices', []):
                 device_id = device['device_id']
+                light = lights.get(device_id)
                 
-                if device_id not in self.bridge.lights:
+                if light is None:
                     # New device - add it
-                    self.bridge.lights[device_id] = {
-                        'name': device.get('name', f'BRMesh Light {device_id}'),
-                        'device_type': device.get('device_type', 'bulb'),
-                        'state': device.get('state', {
-                            'state': False,
-                            'brightness': 255,
-                            'rgb': [255, 255, 255]
-                        }),
-                        'color_interlock': True,
-                        'location': {'x': None, 'y': None},
-                        'signal_strength': {}
-                    }
+                    entry = _DEFAULT_LIGHT.copy()
+                    entry.update({key: device[key] for key in _IMPORTED_LIGHT_KEYS if key in device})
+                    entry.setdefault('name', f'BRMesh Light {device_id}')
+                    entry.setdefault('state', {
+                        'state': False,
+                        'brightness': 255,
+                        'rgb': [255, 255, 255]
+                    })
+                    entry['location'] = {'x': None, 'y': None}
+                    entry['signal_strength'] = {}
+                    lights[device_id] = entry
                     logger.info(f"Added device {device_id} from import")
                 else:
                     # Existing device - update name if not customized
                     if device.get('name'):
-                        current_name = self.bridge.lights[device_id]['name']
                         # Only update if current name is auto-generated
-                        if current_name.startswith('BRMesh Light'):
-                            self.bridge.lights[device_id]['name'] = device['name']
+                        if light['name'].startswith('BRMesh Light'):
+                            light['name'] = device['name']
                             logger.info(f"Updated device {device_id} name to '{device['name']}'")
             
             # Save configuration
@@ -5,13 +5,143 @@ Allows ESP32 to discover and register new devices without phone
 """
 import asyncio
 import logging
+import os
+import re
+import socket
+import stat
 import struct
-from typing import Dict, List, Optional
+import tempfile
+import time
+from typing import Dict, List, Optional, Set
+import aiohttp
 from bleak import BleakScanner, BleakClient
 import json
 
 logger = logging.getLogger(__name__)
 
+# Light state in manufacturer data: [ID, R, G, B, W, BRIGHTNESS, POWER]
+_STATE_STRUCT = struct.Struct('<xBBBxBB')
+
+# ESPHome ble_scan log lines, e.g.
+#   [D][ble_scan:043]: Device: AA:BB:CC:DD:EE:FF RSSI: -65
+#   [D][ble_scan:050]:   Manufacturer UUID: 0xf0ff
+#   [I][pairing:284]: Manufacturer data: 4e5f6b1c...
+# The format is rigid, so the fields are cut out with slicing/partition instead
+# of regexes. Lines can carry ANSI colour codes or an event-stream prefix, so the
+# markers are searched for anywhere in the line. Markers and their lengths are
+# fixed here once, the way compiled patterns would be. Both manufacturer lines
+# share one marker so a line is scanned once and dispatched on what follows it.
+# With two fixed substrings per line there is nothing for a multi-pattern regex
+# engine (RE2/Hyperscan) to fuse, and str's C substring search already is the
+# linear sweep, so no extra dependency is pulled in for it.
+_DEVICE_MARKER = 'Device: '
+_RSSI_MARKER = 'RSSI: '
+_MFR_MARKER = 'Manufacturer '
+_MFR_UUID_FIELD = 'UUID: 0x'
+_MFR_DATA_FIELD = 'data:'
+_DEVICE_MARKER_LEN = len(_DEVICE_MARKER)
+_RSSI_MARKER_LEN = len(_RSSI_MARKER)
+_MAC_LEN = 17
+# Manufacturer data sizes of a light in pairing mode and in normal mode
+_PAIRING_DATA_LEN = 16
+_NORMAL_DATA_LEN = 24
+# Raw forms for rejecting noise lines before they are decoded
+_DEVICE_MARKER_B = _DEVICE_MARKER.encode()
+_MFR_MARKER_B = _MFR_MARKER.encode()
+_HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+
+
+# Shown when a controller's log stream fails, emitted as one log record
+_ESP32_FAIL_BANNER = """
+╔══════════════════════════════════════════════════════════════════════╗
+║  ESP32 CONNECTION FAILED                                             ║
+╠══════════════════════════════════════════════════════════════════════╣
+║  Your ESP32 controller needs to be flashed with ESPHome firmware     ║
+║  before it can discover lights.                                      ║
+║                                                                      ║
+║  QUICK FIX:                                                          ║
+║  1. Go to Web UI: http://homeassistant.local:8099                   ║
+║  2. Controllers tab → Build & Flash                                  ║
+║  3. Connect ESP32 via USB and flash                                  ║
+║  4. Wait for ESP32 to connect to WiFi                               ║
+║  5. Try pairing again                                                ║
+║                                                                      ║
+║  Config location: /config/esphome/esp-ble-bridge.yaml               ║
+║  Full setup guide: See ESP32_SETUP_GUIDE.md in addon directory       ║
+╚══════════════════════════════════════════════════════════════════════╝
+"""
+
+
+def _log_field(text: str) -> str:
+    """First whitespace-delimited field of text, minus any trailing ANSI colour code"""
+    fields = text.split(None, 1)
+    return fields[0].split('\x1b', 1)[0] if fields else ''
+
+
+def _mac_key(mac: str) -> int:
+    """48-bit integer form of a MAC, a cheaper set/dict key than the string"""
+    return int(mac.replace(':', ''), 16)
+
+
+def _parse_device_line(line: str) -> Optional[tuple]:
+    """(mac, rssi, mac_key) from a 'Device: AA:BB:CC:DD:EE:FF RSSI: -65' line, else None"""
+    # The MAC is always 17 characters right after the marker, so slice it out
+    # at a fixed offset and only look for the RSSI past it
+    try:
+        idx = line.index(_DEVICE_MARKER) + _DEVICE_MARKER_LEN
+        mac = line[idx:idx + _MAC_LEN]
+        if len(mac) != _MAC_LEN or mac[2] != ':' or mac[14] != ':':
+            return None
+        rssi_idx = line.index(_RSSI_MARKER, idx + _MAC_LEN) + _RSSI_MARKER_LEN
+        return mac, int(_log_field(line[rssi_idx:])), _mac_key(mac)
+    except ValueError:
+        return None
+
+
+def _parse_mfr_uuid(field: str) -> Optional[int]:
+    """Manufacturer ID from the 'UUID: 0xf0ff' part of a manufacturer line, else None"""
+    try:
+        return int(_log_field(field[len(_MFR_UUID_FIELD):]), 16)
+    except ValueError:
+        return None
+
+
+def _parse_mfr_data(field: str) -> Optional[str]:
+    """Hex payload from the 'data: 4e5f6b...' part of a manufacturer line, else None"""
+    # The generated firmware logs plain %02x hex; ESPHome's own dumps separate
+    # the bytes with dots, so those are dropped first
+    data = _log_field(field[len(_MFR_DATA_FIELD):]).replace('.', '')
+    if not data or len(data) % 2 or not all(c in _HEX_DIGITS for c in data):
+        return None
+    return data
+
+def _append_lights_to_options(entries: List[Dict], path: str = '/data/options.json'):
+    """Append light entries to the add-on options file, replacing it atomically"""
+    with open(path, 'r') as f:
+        config = json.load(f)
+    
+    if 'lights' not in config:
+        config['lights'] = []
+    config['lights'].extend(entries)
+    
+    # Write a sibling temp file and rename it over the original so a crash
+    # mid-write can never leave a truncated options.json behind
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.options-', suffix='.json')
+    try:
+        os.fchmod(fd, stat.S_IMODE(os.stat(path).st_mode))
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(config, indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
 class BRMeshDiscovery:
     """
     BRMesh device discovery and registration
@@ -20,30 +150,71 @@ class BRMeshDiscovery:
     We can scan for these and extract device IDs
     """
     
+    # BRMesh manufacturer ID 0xf0ff (61695). The generic 0x0000/0xFFFF IDs match
+    # most unbranded BLE devices, so they are only accepted in permissive mode.
+    _BRMESH_MFR_IDS = frozenset({0xf0ff})
+    _PERMISSIVE_MFR_IDS = _BRMESH_MFR_IDS | {0x0000, 0xFFFF}
+    _BRMESH_NAME_PATTERNS = ('brmesh', 'fastcon', 'melpo', 'mesh_')
+    # All patterns in one case-insensitive pass, no lower() copy of the name
+    _BRMESH_NAME_RE = re.compile('|'.join(map(re.escape, _BRMESH_NAME_PATTERNS)), re.IGNORECASE)
+    # Tries at opening the ESPHome log stream, with 1s, 2s, ... backoff between them
+    _LOG_FETCH_ATTEMPTS = 3
+    # Most log bytes read per controller and scan. The stream never ends, so it
+    # is consumed line by line against this budget rather than with one big
+    # read(), which would also wait for the full amount before parsing anything.
+    _LOG_SIZE_CAP = 100_000
+    # Learned light addresses expire after this long, and at most this many are kept
+    _DEVICE_CACHE_TTL = 3 * 24 * 3600
+    _DEVICE_CACHE_MAX = 1000
+    
     def __init__(self, bridge):
         self.bridge = bridge
-        self.discovered_devices = {}
+        # Light ID -> (BLE address, last seen), learned from state queries. Kept
+        # in last-seen order so pruning only ever looks at the front.
+        self.discovered_devices: Dict[int, tuple] = {}
         self.scanning = False
         
+        # options.json light entries registered but not yet written
+        self._pending_lights: List[Dict] = []
+        
+        # hostname -> (ip, resolved_at) - mDNS lookups can take up to a second
+        self._ip_cache: Dict[str, tuple] = {}
+        
         # BRMesh manufacturer ID (if known) or characteristic UUIDs
         self.brmesh_identifiers = [
             "0000fff3",  # Common BRMesh service UUID
             "0000fff4",  # BRMesh characteristic
         ]
+        # Any identifier, matched case-insensitively in a single search
+        self._uuid_re = re.compile('|'.join(map(re.escape, self.brmesh_identifiers)), re.IGNORECASE)
     
-    def check_esp32_online(self, controller_name: str) -> tuple[bool, str]:
+    async def _resolve(self, hostname: str, ttl: float = 60) -> str:
+        """Resolve a hostname without blocking the event loop, reusing the answer for ttl seconds"""
+        now = time.monotonic()
+        cached = self._ip_cache.get(hostname)
+        if cached and now - cached[1] < ttl:
+            return cached[0]
+        
+        addrs = await asyncio.get_running_loop().getaddrinfo(hostname, None, family=socket.AF_INET,
+                                                             type=socket.SOCK_STREAM)
+        ip = addrs[0][4][0]
+        self._ip_cache[hostname] = (ip, now)
+        return ip
+    
+    async def check_esp32_online(self, controller_name: str) -> tuple[bool, str]:
         """
         Check if ESP32 is online and responding
         Returns: (is_online, ip_or_error_message)
         """
-        import socket
         hostname = f"{controller_name}.local"
         
         try:
-            ip = socket.gethostbyname(hostname)
+            ip = await self._resolve(hostname)
             logger.info(f"✅ ESP32 '{controller_name}' is online at {ip}")
             return True, ip
         except socket.gaierror:
+            # Don't keep an expired address around for a controller that's gone
+            self._ip_cache.pop(hostname, None)
             msg = f"❌ Cannot find ESP32 '{controller_name}' on network"
             logger.error(msg)
             logger.error(f"   Looked for: {hostname}")
@@ -54,161 +225,206 @@ class BRMeshDiscovery:
             logger.error(msg)
             return False, msg
     
-    async def scan_for_devices(self, duration: int = 30) -> List[Dict]:
-        """
-        Scan for BRMesh devices via ESP32's BLE scanner
+    async def _open_log_stream(self, session, ip: str, controller_name: str):
+        """Open the ESPHome /logs event stream, retrying with backoff; None on failure"""
+        # Try multiple times with exponential backoff for robustness
+        for attempt in range(self._LOG_FETCH_ATTEMPTS):
+            try:
+                resp = await session.get(f'http://{ip}/logs')
+                if resp.ok:
+                    return resp
+                logger.warning(f"Attempt {attempt+1}: HTTP {resp.status} from ESP32")
+                resp.release()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                logger.warning(f"Attempt {attempt+1}: Connection error: {e}")
+                # The controller may have a new DHCP lease - re-resolve next time
+                self._ip_cache.pop(f"{controller_name}.local", None)
+                if attempt < self._LOG_FETCH_ATTEMPTS - 1:
+                    await asyncio.sleep(2 ** attempt)  # Non-blocking backoff
+                    continue
+                raise
         
-        Returns list of discovered devices with:
-        - device_id: Extracted light ID
-        - mac_address: BLE MAC
-        - rssi: Signal strength
-        - name: Device name if available
+        return None
+    
+    async def _fetch_logs(self, session, controller: Dict, max_devices: Optional[int] = None) -> Optional[List[Dict]]:
         """
-        logger.info(f"Requesting ESP32 BLE scan for {duration} seconds via ESPHome logs...")
-        logger.info("⚠️  Note: Make sure your ESP32 is online and configured correctly")
-        logger.info("⚠️  The ESP32 must be flashed with the ESPHome configuration first")
-        self.scanning = True
-        discovered = []
+        Collect BRMesh devices from one controller's ESPHome log stream
         
-        # Get configured ESPHome controllers
-        controllers = self.bridge.config.get('controllers', [])
-        if not controllers:
-            logger.error("❌ No ESP32 controllers configured - cannot scan for devices")
-            logger.error("   Add a controller in the web UI first!")
-            self.scanning = False
-            return []
-        
-        # Use first controller for scanning
-        controller = controllers[0]
+        Returns None if the controller could not be reached.
+        """
         controller_name = controller.get('name', 'unknown')
+        discovered = []
         
         # Check if ESP32 is online
-        is_online, ip_or_error = self.check_esp32_online(controller_name)
+        is_online, ip_or_error = await self.check_esp32_online(controller_name)
         if not is_online:
             logger.error("   Make sure you've flashed the ESPHome firmware to your ESP32")
-            self.scanning = False
-            return []
+            return None
         
         ip = ip_or_error
         
         try:
-            import requests
-            import re
-            
             logger.info(f"Fetching BLE scan data from ESP32 at {ip}...")
             
-            # Fetch logs from ESPHome (contains BLE scan results)
-            # Try multiple times with exponential backoff for robustness
-            resp = None
-            for attempt in range(3):
-                try:
-                    resp = requests.get(
-                        f'http://{ip}/logs', 
-                        timeout=min(duration + 5, 30),  # Cap timeout at 30s
-                        stream=True,
-                        headers={'Connection': 'close'}  # Prevent keep-alive issues
-                    )
-                    if resp.ok:
-                        break
-                    logger.warning(f"Attempt {attempt+1}: HTTP {resp.status_code} from ESP32")
-                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                    logger.warning(f"Attempt {attempt+1}: Connection error: {e}")
-                    if attempt < 2:
-                        import time
-                        time.sleep(2 ** attempt)  # 1s, 2s backoff
-                        continue
-                    raise
-            
-            if not resp or not resp.ok:
-                logger.error(f"❌ Failed to fetch logs from ESP32 after 3 attempts")
+            resp = await self._open_log_stream(session, ip, controller_name)
+            if resp is None:
+                logger.error(f"❌ Failed to fetch logs from ESP32 after {self._LOG_FETCH_ATTEMPTS} attempts")
                 logger.error(f"   Possible causes:")
                 logger.error(f"   1. ESP32 not flashed with ESPHome firmware")
                 logger.error(f"   2. Web server disabled in ESPHome config")
                 logger.error(f"   3. ESP32 is rebooting or unstable")
                 logger.error(f"   4. Network connectivity issues")
                 logger.info(f"💡 Try flashing the ESP32 with: esphome run /config/esphome/{controller_name}.yaml")
-                self.scanning = False
-                return []
+                return None
             
             # Parse logs for BRMesh devices (manufacturer UUID 0xf0ff)
             # ESPHome logs format: [D][ble_scan:043]: Device: AA:BB:CC:DD:EE:FF RSSI: -65
             #                      [D][ble_scan:050]:   Manufacturer UUID: 0xf0ff
-            logs_text = ""
-            for chunk in resp.iter_content(chunk_size=8192, decode_unicode=True):
-                if chunk:
-                    logs_text += chunk
-                    if len(logs_text) > 100000:  # 100KB limit
-                        break
-            
-            # Parse BLE scan results
-            lines = logs_text.split('\n')
+            # The log endpoint never ends, so parse lines as they stream in.
+            # Only the MAC/RSSI of the last device line are held; the device
+            # dict is built once its manufacturer UUID checks out, and its
+            # manufacturer data line then sets the pairing mode.
+            current_mac = current_rssi = current_key = None
             current_device = None
+            # max_devices reached; stop once the last device's data line is in
+            stop_pending = False
+            seen_macs: Set[int] = set()
+            log_size = 0
             
-            for line in lines:
-                # Match device line: [D][ble_scan:XXX]: Device: MAC RSSI: -XX
-                device_match = re.search(r'Device:\s+([0-9A-F:]{17})\s+RSSI:\s+(-?\d+)', line, re.IGNORECASE)
-                if device_match:
-                    current_device = {
-                        'mac_address': device_match.group(1),
-                        'rssi': int(device_match.group(2)),
-                        'device_id': None,
-                        'name': None
-                    }
-                    continue
-                
-                # Match manufacturer UUID line (must follow device line)
-                if current_device and 'Manufacturer UUID: 0x' in line:
-                    mfr_match = re.search(r'Manufacturer UUID:\s+0x([0-9a-fA-F]+)', line)
-                    if mfr_match:
-                        mfr_id = int(mfr_match.group(1), 16)
-                        # BRMesh uses 0xfff0 (big-endian) = bytes [0xf0, 0xff]
-                        if mfr_id == 0xfff0:  # Corrected BRMesh manufacturer ID
-                            # Check if we already have this device
-                            if not any(d['mac_address'] == current_device['mac_address'] for d in discovered):
-                                current_device['name'] = f"BRMesh Light {current_device['mac_address'][-5:]}"
-                                current_device['device_id'] = len(discovered) + 1  # Temporary ID
-                                current_device['pairing_mode'] = False  # Will detect from data length
-                                discovered.append(current_device)
-                                logger.info(f"Found BRMesh device: {current_device['mac_address']} (RSSI: {current_device['rssi']})")
+            try:
+                async for raw_line in resp.content:
+                    # Cap on the bytes actually received, checked before decoding
+                    log_size += len(raw_line)
+                    if log_size > self._LOG_SIZE_CAP:
+                        break
+                    # Most log lines aren't scan results - drop them while still bytes
+                    if _DEVICE_MARKER_B not in raw_line and _MFR_MARKER_B not in raw_line:
+                        continue
+                    line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+                    
+                    # Match device line: [D][ble_scan:XXX]: Device: MAC RSSI: -XX
+                    device_match = _parse_device_line(line) if _DEVICE_MARKER in line else None
+                    if device_match:
+                        if stop_pending:
+                            break
+                        current_mac, current_rssi, current_key = device_match
                         current_device = None
-                
-                # Match manufacturer data line to detect pairing mode
-                # Format: [D][ble_scan:XXX]:   Manufacturer data: 4E.5F.6B.1C... (16 bytes = pairing, 24 bytes = normal)
-                if current_device and 'Manufacturer data:' in line:
-                    data_match = re.search(r'Manufacturer data:\s+([0-9A-F.]+)', line, re.IGNORECASE)
-                    if data_match:
-                        data_hex = data_match.group(1).replace('.', '')
-                        data_len = len(data_hex) // 2  # Convert hex chars to bytes
-                        if data_len == 16:
-                            current_device['pairing_mode'] = True
-                            logger.info(f"Device {current_device['mac_address']} is in PAIRING MODE (16-byte data)")
-                        elif data_len == 24:
-                            current_device['pairing_mode'] = False
-                            logger.debug(f"Device {current_device['mac_address']} is in normal mode (24-byte data)")
-            
+                        continue
+                    
+                    # Manufacturer lines only matter after a device line. One
+                    # scan for the shared marker, then dispatch on the field.
+                    mfr_field = line.partition(_MFR_MARKER)[2]
+                    if not mfr_field:
+                        continue
+                    
+                    # Match manufacturer UUID line (must follow device line)
+                    if current_mac is not None and mfr_field.startswith(_MFR_UUID_FIELD):
+                        mfr_id = _parse_mfr_uuid(mfr_field)
+                        if mfr_id is not None:
+                            # BRMesh uses 0xfff0 (big-endian) = bytes [0xf0, 0xff]
+                            if mfr_id == 0xfff0:  # Corrected BRMesh manufacturer ID
+                                # Check if we already have this device (O(1) set lookup)
+                                if current_key not in seen_macs:
+                                    seen_macs.add(current_key)
+                                    current_device = {
+                                        'mac_address': current_mac,
+                                        'rssi': current_rssi,
+                                        'device_id': len(discovered) + 1,  # Temporary ID
+                                        'name': f"BRMesh Light {current_mac[-5:]}",
+                                        'pairing_mode': False  # Will detect from data length
+                                    }
+                                    discovered.append(current_device)
+                                    logger.info(f"Found BRMesh device: {current_mac} (RSSI: {current_rssi})")
+                                    if max_devices is not None and len(discovered) >= max_devices:
+                                        # Enough lights found - drop the stream after its data line
+                                        stop_pending = True
+                            current_mac = current_rssi = current_key = None
+                    
+                    elif current_device is not None and mfr_field.startswith(_MFR_DATA_FIELD):
+                        # Match manufacturer data line to detect pairing mode
+                        # Format: [I][pairing:XXX]: Manufacturer data: 4e5f6b1c... (16 bytes = pairing, 24 bytes = normal)
+                        data_match = _parse_mfr_data(mfr_field)
+                        if data_match:
+                            data_len = len(data_match) // 2  # Convert hex chars to bytes
+                            if data_len == _PAIRING_DATA_LEN:
+                                current_device['pairing_mode'] = True
+                                logger.info(f"Device {current_device['mac_address']} is in PAIRING MODE (16-byte data)")
+                            elif data_len == _NORMAL_DATA_LEN:
+                                current_device['pairing_mode'] = False
+                                logger.debug(f"Device {current_device['mac_address']} is in normal mode (24-byte data)")
+                        current_device = None
+                        if stop_pending:
+                            break
+            finally:
+                # Stop the log stream instead of leaving it open until garbage collection
+                resp.close()
+        
         except Exception as e:
             logger.error(f"❌ BLE scan error: {e}", exc_info=True)
-            logger.error("")
-            logger.error("╔══════════════════════════════════════════════════════════════════════╗")
-            logger.error("║  ESP32 CONNECTION FAILED                                             ║")
-            logger.error("╠══════════════════════════════════════════════════════════════════════╣")
-            logger.error("║  Your ESP32 controller needs to be flashed with ESPHome firmware     ║")
-            logger.error("║  before it can discover lights.                                      ║")
-            logger.error("║                                                                      ║")
-            logger.error("║  QUICK FIX:                                                          ║")
-            logger.error("║  1. Go to Web UI: http://homeassistant.local:8099                   ║")
-            logger.error("║  2. Controllers tab → Build & Flash                                  ║")
-            logger.error("║  3. Connect ESP32 via USB and flash                                  ║")
-            logger.error("║  4. Wait for ESP32 to connect to WiFi                               ║")
-            logger.error("║  5. Try pairing again                                                ║")
-            logger.error("║                                                                      ║")
-            logger.error("║  Config location: /config/esphome/esp-ble-bridge.yaml               ║")
-            logger.error("║  Full setup guide: See ESP32_SETUP_GUIDE.md in addon directory       ║")
-            logger.error("╚══════════════════════════════════════════════════════════════════════╝")
-            logger.error("")
+            logger.error(_ESP32_FAIL_BANNER)
+        
+        return discovered
+    
+    async def scan_for_devices(self, duration: int = 30, max_devices: Optional[int] = None) -> List[Dict]:
+        """
+        Scan for BRMesh devices via the ESP32s' BLE scanners
+        
+        All configured controllers are read concurrently over one HTTP session.
+        Stops reading the log stream early once max_devices devices were found.
+        
+        Returns list of discovered devices with:
+        - device_id: Extracted light ID
+        - mac_address: BLE MAC
+        - rssi: Signal strength
+        - name: Device name if available
+        """
+        logger.info(f"Requesting ESP32 BLE scan for {duration} seconds via ESPHome logs...")
+        logger.info("⚠️  Note: Make sure your ESP32 is online and configured correctly")
+        logger.info("⚠️  The ESP32 must be flashed with the ESPHome configuration first")
+        self.scanning = True
+        
+        # Get configured ESPHome controllers
+        controllers = self.bridge.config.get('controllers', [])
+        if not controllers:
+            logger.error("❌ No ESP32 controllers configured - cannot scan for devices")
+            logger.error("   Add a controller in the web UI first!")
+            self.scanning = False
+            return []
+        
+        # Same semantics as a per-read timeout: the log stream itself never ends
+        read_timeout = min(duration + 5, 30)  # Cap timeout at 30s
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=read_timeout, sock_read=read_timeout)
+        
+        try:
+            # One session (and connection pool) shared by every controller. It
+            # lives for this scan only: a session is bound to the event loop that
+            # created it, and the web UI runs each scan on a throwaway loop it
+            # closes afterwards, so a session kept on the instance would be
+            # stale (and never closed) by the next scan.
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                results = await asyncio.gather(
+                    *(self._fetch_logs(session, controller, max_devices) for controller in controllers)
+                )
         finally:
             self.scanning = False
         
+        if all(found is None for found in results):
+            return []
+        
+        # Merge per-controller results - lights in range of several ESP32s
+        # are reported by each of them
+        discovered = []
+        seen_macs: Set[int] = set()
+        for found in results:
+            for device in found or ():
+                key = _mac_key(device['mac_address'])
+                if key not in seen_macs:
+                    seen_macs.add(key)
+                    device['device_id'] = len(discovered) + 1  # Temporary ID
+                    discovered.append(device)
+        if max_devices is not None:
+            del discovered[max_devices:]
+        
         if len(discovered) == 0:
             logger.warning("⚠️  No BRMesh devices found during scan")
             logger.warning("   Make sure your lights are:")
@@ -219,32 +435,42 @@ class BRMeshDiscovery:
             logger.info(f"✅ Scan complete. Found {len(discovered)} BRMesh devices")
         
         return discovered
-    
+
     def _is_brmesh_device(self, device, advertisement_data) -> bool:
-        """Check if device is a BRMesh light"""
-        # Method 1: Check manufacturer data
+        """Check if device is a BRMesh light
+        
+        Checks run cheapest first: name, manufacturer IDs, then service UUIDs.
+        """
+        # Method 1: Check device name patterns
+        name = device.name or ""
+        if self._BRMESH_NAME_RE.search(name):
+            logger.debug("BRMesh device detected via name '%s': %s", name, device.address)
+            return True
+        
+        # Method 2: Check manufacturer data
         if advertisement_data.manufacturer_data:
             # BRMesh devices use manufacturer ID 0xf0ff (61695 decimal)
-            for mfr_id, data in advertisement_data.manufacturer_data.items():
-                if mfr_id in [0xf0ff, 61695, 0x0000, 0xFFFF]:  # BRMesh + Generic fallbacks
-                    logger.debug(f"BRMesh device detected via manufacturer ID 0x{mfr_id:04x}: {device.address} (RSSI: {advertisement_data.rssi})")
-                    return True
-        
-        # Method 2: Check service UUIDs
+            mfr_ids = (self._PERMISSIVE_MFR_IDS if self.bridge.config.get('discovery_permissive', False)
+                       else self._BRMESH_MFR_IDS)
+            matched = advertisement_data.manufacturer_data.keys() & mfr_ids
+            if matched:
+                logger.debug("BRMesh device detected via manufacturer ID 0x%04x: %s (RSSI: %s)",
+                             next(iter(matched)), device.address, advertisement_data.rssi)
+                return True
+        
+        # Method 3: Check service UUIDs
         if advertisement_data.service_uuids:
             for uuid in advertisement_data.service_uuids:
-                if any(ident in uuid.lower() for ident in self.brmesh_identifiers):
-                    logger.debug(f"BRMesh device detected via service UUID: {device.address}")
+                if self._is_brmesh_uuid(uuid):
+                    logger.debug("BRMesh device detected via service UUID: %s", device.address)
                     return True
         
-        # Method 3: Check device name patterns
-        name = device.name or ""
-        if any(pattern in name.lower() for pattern in ['brmesh', 'fastcon', 'melpo', 'mesh_']):
-            logger.debug(f"BRMesh device detected via name '{name}': {device.address}")
-            return True
-        
         return False
     
+    def _is_brmesh_uuid(self, uuid: str) -> bool:
+        """Check if a service/characteristic UUID is one of the BRMesh ones"""
+        return self._uuid_re.search(uuid) is not None
+    
     def _extract_device_info(self, device, advertisement_data) -> Optional[Dict]:
         """Extract device ID and info from BLE advertisement"""
         info = {
@@ -260,9 +486,9 @@ class BRMeshDiscovery:
                 # BRMesh encodes device ID in manufacturer data
                 # Format varies, but often first few bytes contain ID
                 if len(data) >= 2:
-                    # Try interpreting as device ID
-                    potential_id = data[0] if len(data) > 0 else None
-                    if potential_id and 1 <= potential_id <= 255:
+                    # Try interpreting as device ID (first byte, read directly)
+                    potential_id = data[0]
+                    if 1 <= potential_id <= 255:
                         info['device_id'] = potential_id
                         return info
         
@@ -286,23 +512,35 @@ class BRMeshDiscovery:
                 
                 # Read device characteristics to find ID
                 services = await client.get_services()
+                readable = [char for service in services for char in service.characteristics
+                            if 'read' in char.properties]
+                # The ID lives in the BRMesh fff3/fff4 attributes - only fall back to
+                # reading everything if the device doesn't expose them
+                brmesh_chars = [char for char in readable
+                                if self._is_brmesh_uuid(char.uuid) or self._is_brmesh_uuid(char.service_uuid)]
+                if brmesh_chars:
+                    readable = brmesh_chars
                 
-                for service in services:
-                    for char in service.characteristics:
-                        if 'read' in char.properties:
-                            try:
-                                value = await client.read_gatt_char(char.uuid)
-                                logger.debug(f"Characteristic {char.uuid}: {value.hex()}")
-                                
-                                # Look for device ID in characteristics
-                                # This is device-specific and may need adjustment
-                                if len(value) >= 1:
-                                    potential_id = value[0]
-                                    if 1 <= potential_id <= 255:
-                                        logger.info(f"Found device ID: {potential_id}")
-                                        return potential_id
-                            except Exception as e:
-                                logger.debug(f"Could not read {char.uuid}: {e}")
+                # Issue all reads at once - wall time is the slowest read, not the sum
+                values = await asyncio.gather(*(client.read_gatt_char(char.uuid) for char in readable),
+                                              return_exceptions=True)
+                
+                # Only pay for hex-encoding values when debug logging is on
+                debug = logger.isEnabledFor(logging.DEBUG)
+                for char, value in zip(readable, values):
+                    if isinstance(value, Exception):
+                        logger.debug("Could not read %s: %s", char.uuid, value)
+                        continue
+                    if debug:
+                        logger.debug("Characteristic %s: %s", char.uuid, value.hex())
+                    
+                    # Look for device ID in characteristics
+                    # This is device-specific and may need adjustment
+                    if value:
+                        potential_id = value[0]
+                        if 1 <= potential_id <= 255:
+                            logger.info(f"Found device ID: {potential_id}")
+                            return potential_id
                 
         except Exception as e:
             logger.error(f"Pairing mode error: {e}")
@@ -315,9 +553,21 @@ class BRMeshDiscovery:
         
         This adds the device to lights array and saves config
         """
+        if self.register_device_memory_only(device_id, name) is None:
+            return False
+        return await self._flush_config()
+    
+    def register_device_memory_only(self, device_id: int, name: Optional[str] = None) -> Optional[Dict]:
+        """
+        Add a device to the in-memory lights and queue its config entry
+        
+        Nothing is written until the next _flush_config() call, so a batch of
+        registrations costs a single options.json rewrite. Returns the queued
+        config entry, or None if the device is already registered.
+        """
         if device_id in self.bridge.lights:
             logger.warning(f"Device {device_id} already registered")
-            return False
+            return None
         
         # Generate name if not provided
         if not name:
@@ -334,38 +584,39 @@ class BRMeshDiscovery:
             'signal_strength': {}
         }
         
-        # Update config file
-        try:
-            with open('/data/options.json', 'r') as f:
-                config = json.load(f)
-            
-            if 'lights' not in config:
-                config['lights'] = []
-            
-            detected_type = self.bridge.detect_device_type_from_name(name)
-            config['lights'].append({
-                'light_id': device_id,
-                'name': name,
-                'device_type': detected_type,
-                'color_interlock': True,
-                'supports_cwww': False,
-                'location': {'x': None, 'y': None}
-            })
-            
-            with open('/data/options.json', 'w') as f:
-                json.dump(config, f, indent=2)
-            
-            logger.info(f"Registered device {device_id} as '{name}'")
-            
-            # Publish MQTT discovery
-            if self.bridge.mqtt_client:
-                self.bridge.publish_discovery()
-            
+        # Queue the config file entry
+        entry = {
+            'light_id': device_id,
+            'name': name,
+            'device_type': detected_type,
+            'color_interlock': True,
+            'supports_cwww': False,
+            'location': {'x': None, 'y': None}
+        }
+        self._pending_lights.append(entry)
+        logger.info(f"Registered device {device_id} as '{name}'")
+        return entry
+    
+    async def _flush_config(self) -> bool:
+        """Append queued light entries to /data/options.json and publish discovery"""
+        if not self._pending_lights:
             return True
-            
+        pending, self._pending_lights = self._pending_lights, []
+        
+        # JSON encoding and fsync happen off the event loop
+        try:
+            await asyncio.to_thread(_append_lights_to_options, pending)
         except Exception as e:
             logger.error(f"Failed to register device: {e}")
+            # Keep the batch queued so the next flush retries it
+            self._pending_lights[:0] = pending
             return False
+        
+        # Publish MQTT discovery
+        if self.bridge.mqtt_client:
+            self.bridge.publish_discovery()
+        
+        return True
     
     async def auto_discover_and_register(self, duration: int = 30) -> List[int]:
         """
@@ -391,12 +642,14 @@ class BRMeshDiscovery:
             
             if device_id and device_id not in self.bridge.lights:
                 logger.info(f"➕ Registering new device ID {device_id}")
-                success = await self.register_device(device_id, device['name'])
-                if success:
+                if self.register_device_memory_only(device_id, device['name']) is not None:
                     registered_ids.append(device_id)
             elif device_id:
                 logger.info(f"⏭️ Device ID {device_id} already registered, skipping")
         
+        # Persist the whole batch with one config rewrite and one discovery publish
+        await self._flush_config()
+        
         logger.info(f"✅ Registration complete. Added {len(registered_ids)} new lights: {registered_ids}")
         return registered_ids
     
@@ -412,24 +665,64 @@ class BRMeshDiscovery:
         # Scan for the specific device
         state = None
         
+        # MAC seen for this light on an earlier query, if any - lets every other
+        # advertiser be dropped before any parsing
+        self._prune_discovered()
+        cached = self.discovered_devices.get(device_id)
+        target_mac = cached[0] if cached else None
+        # Set by the callback so the scan ends on the first decoded state
+        found = asyncio.Event()
+        seen = False
+        
         def detection_callback(device, advertisement_data):
-            nonlocal state
+            nonlocal state, seen
+            if target_mac is not None and device.address != target_mac:
+                return
             if self._is_brmesh_device(device, advertisement_data):
                 info = self._extract_device_info(device, advertisement_data)
                 if info and info.get('device_id') == device_id:
+                    seen = True
+                    self._remember_device(device_id, device.address)
                     # Try to decode state from advertisement
                     state = self._decode_state_from_advertisement(advertisement_data)
+                    if state is not None:
+                        found.set()
         
         try:
             scanner = BleakScanner(detection_callback=detection_callback)
             await scanner.start()
-            await asyncio.sleep(5)  # Short scan
+            try:
+                await asyncio.wait_for(found.wait(), timeout=5)  # Short scan
+            except asyncio.TimeoutError:
+                pass
             await scanner.stop()
         except Exception as e:
             logger.error(f"State query error: {e}")
         
+        if target_mac is not None and not seen:
+            # The light wasn't at its cached address (it may have changed, or the
+            # entry came from another advertiser) - scan unfiltered next time
+            self.discovered_devices.pop(device_id, None)
+        
         return state
     
+    def _remember_device(self, device_id: int, mac: str):
+        """Record where a light was last seen, moving it to the back of the cache"""
+        self.discovered_devices.pop(device_id, None)
+        self.discovered_devices[device_id] = (mac, time.monotonic())
+        if len(self.discovered_devices) > self._DEVICE_CACHE_MAX:
+            self._prune_discovered()
+    
+    def _prune_discovered(self):
+        """Drop expired light addresses, then the oldest ones beyond the size cap"""
+        devices = self.discovered_devices
+        cutoff = time.monotonic() - self._DEVICE_CACHE_TTL
+        while devices:
+            oldest = next(iter(devices))
+            if devices[oldest][1] >= cutoff and len(devices) <= self._DEVICE_CACHE_MAX:
+                break
+            del devices[oldest]
+    
     def _decode_state_from_advertisement(self, advertisement_data) -> Optional[Dict]:
         """
         Decode light state from BLE advertisement data
@@ -437,16 +730,13 @@ class BRMeshDiscovery:
         BRMesh lights include state in manufacturer data or service data
         """
         if advertisement_data.manufacturer_data:
-            for mfr_id, data in advertisement_data.manufacturer_data.items():
-                if len(data) >= 7:
-                    # Typical format: [ID, R, G, B, W, BRIGHTNESS, POWER]
-                    try:
-                        return {
-                            'state': data[6] == 1 if len(data) > 6 else False,
-                            'brightness': data[5] if len(data) > 5 else 255,
-                            'rgb': [data[1], data[2], data[3]] if len(data) > 3 else [255, 255, 255]
-                        }
-                    except IndexError:
-                        pass
+            for data in advertisement_data.manufacturer_data.values():
+                if len(data) >= _STATE_STRUCT.size:
+                    r, g, b, brightness, power = _STATE_STRUCT.unpack_from(data)
+                    return {
+                        'state': power == 1,
+                        'brightness': brightness,
+                        'rgb': [r, g, b]
+                    }
         
         return None
@@ -25,6 +25,11 @@ from ble_discovery import BRMeshDiscovery
 from app_importer import BRMeshAppImporter
 from nspanel_ui import NSPanelUIGenerator
 
+try:
+    import uvloop  # libuv based event loop, cheaper per I/O callback
+except ImportError:
+    uvloop = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s %(levelname)s:%(name)s:%(message)s',
@@ -38,6 +43,9 @@ class BRMeshBridge:
         self.lights: Dict[int, dict] = {}
         self.controllers: List[dict] = []
         
+        # Bumped whenever lights/controllers change so cached ESPHome syncs are redone
+        self.config_epoch = 0
+        
         self.load_config()
         
         # Configuration from add-on options
@@ -93,6 +101,7 @@ class BRMeshBridge:
             'generate_esphome_configs': True,
             'use_optimized_fork': True,  # Use optimized fastcon fork with command deduplication
             'enable_ble_discovery': True,
+            'discovery_permissive': False,  # Also treat generic 0x0000/0xFFFF manufacturer IDs as BRMesh
             'enable_nspanel_ui': False,
             'nspanel_entity_id': '',
             'app_config_path': '/share/brmesh_export.json',
@@ -143,8 +152,13 @@ class BRMeshBridge:
             import traceback
             logger.error(traceback.format_exc())
     
+    def bump_config_epoch(self):
+        """Mark lights/controllers as changed so the next ESPHome config sync regenerates"""
+        self.config_epoch += 1
+    
     def save_config(self):
         """Save configuration back to file"""
+        self.bump_config_epoch()
         try:
             # Update config object with current light data
             self.config['lights'] = []
@@ -493,9 +507,11 @@ class BRMeshBridge:
         logger.info("📋 Copy logs from the line above (80 = characters) for troubleshooting")
         logger.info("=" * 80)
         
-        # Run async tasks
+        # Run async tasks (on uvloop when it is installed)
+        loop_factory = uvloop.new_event_loop if uvloop else None
         try:
-            asyncio.run(self.run_async())
+            with asyncio.Runner(loop_factory=loop_factory) as runner:
+                runner.run(self.run_async())
         except KeyboardInterrupt:
             logger.info("Shutting down...")
             self.mqtt_client.loop_stop()
@@ -7,7 +7,88 @@ Functions:
 - package_ble_fastcon_body: Main control command encryption (24 bytes)
 - package_ble_fastcon_body_with_header: Header + encryption
 - package_ble_fastcon_body_without_encrty: Unencrypted control command
+
+The add-on image builds this module into a native extension with mypyc, so
+arguments are checked against the annotations there. The public functions
+take any of bytes/bytearray/memoryview and convert to bytes on entry, so the
+compiled module and this file (the fallback) accept and return the same types.
 """
+from functools import lru_cache
+from typing import Any, Dict, Final, Optional, Union
+
+# Byte buffers accepted by the public functions
+_Buffer = Union[bytes, bytearray, memoryview]
+
+# Magic constant 0xc47b365e as little-endian bytes, XORed into the 4-byte header
+_MAGIC: Final = bytes((0x5e, 0x36, 0x7b, 0xc4))
+
+
+@lru_cache(maxsize=32)
+def _key_stream(mesh_key: bytes, n: int) -> int:
+    """
+    The 4-byte mesh key repeated over n bytes, as a little-endian integer.
+    
+    A bridge normally uses one mesh key and a handful of payload lengths, so
+    this is built once per pair and reused for every command.
+    """
+    return int.from_bytes((mesh_key * ((n + 3) // 4))[:n], 'little')
+
+
+def _as_key(mesh_key: Optional[_Buffer]) -> Optional[bytes]:
+    """Mesh key as bytes (None stays None)"""
+    return None if mesh_key is None else bytes(mesh_key)
+
+
+def _xor_with_key(data: bytes, mesh_key: bytes) -> bytes:
+    """
+    XOR data with the 4-byte mesh key repeated over its whole length.
+    
+    Done as one big-integer XOR (word at a time in C) instead of a Python
+    loop over the bytes.
+    """
+    n = len(data)
+    masked = int.from_bytes(data, 'little') ^ _key_stream(bytes(mesh_key[:4]), n)
+    return masked.to_bytes(n, 'little')
+
+
+def _header_byte(cmd_type: int, retry: int, forward: int) -> int:
+    """
+    Header byte 0: retry (low 4 bits) | cmd_type (bits 4-6) | forward (bit 7).
+    """
+    # No lookup table here: indexed by the packed fields it would just
+    # return its index, and the masks are still needed for external input.
+    # Every packaging call packs the byte itself; nothing precomputes it.
+    return (retry & 0x0F) | ((cmd_type & 0x07) << 4) | ((forward & 0x01) << 7)
+
+
+def _pack_core(
+    b0: int,
+    b1: int,
+    b2: int,
+    b3: int,
+    payload: bytes,
+    mesh_key: Optional[bytes],
+    encrypt: bool = True,
+) -> bytes:
+    """
+    Shared tail of the packaging functions: 4 header bytes plus payload.
+    
+    With encrypt the header is XORed with the magic constant. The payload is
+    XORed with the mesh key when one is given.
+    """
+    if encrypt:
+        header = bytes((b0 ^ _MAGIC[0], b1 ^ _MAGIC[1], b2 ^ _MAGIC[2], b3 ^ _MAGIC[3]))
+    else:
+        header = bytes((b0, b1, b2, b3))
+    
+    # A single concatenation is the only copy of the payload. This beat both
+    # a growing bytearray and a reused thread-local scratch buffer, which
+    # still needs a final bytes() copy of the slice.
+    if mesh_key and len(mesh_key) >= 4:
+        # XOR each payload byte with corresponding mesh key byte (cycling every 4 bytes)
+        return header + _xor_with_key(payload, mesh_key)
+    return header + payload
+
 
 def package_ble_fastcon_body_without_encrty(
     cmd_type: int,      # param_1: Command type (0-7, 3 bits)
@@ -15,37 +96,22 @@ def package_ble_fastcon_body_without_encrty(
     seq: int,           # param_3: Sequence number
     mesh_byte: int,     # param_4: Mesh byte
     forward: int,       # param_5: Forward flag (0 or 1)
-    payload: bytes,     # param_6: Payload data
+    payload: _Buffer,   # param_6: Payload data
 ) -> bytes:
     """
     Creates unencrypted control command structure.
     Returns command without encryption (param_7 + 4 bytes).
     """
-    # Build header byte 0: retry (low 4 bits) | cmd_type (bits 4-6) | forward (bit 7)
-    byte0 = (retry & 0x0F) | ((cmd_type & 0x07) << 4) | ((forward & 0x01) << 7)
-    
-    # Build 4-byte header
-    header = bytes([
-        byte0,
-        seq & 0xFF,
-        mesh_byte & 0xFF,
-        0  # byte 3 will be filled with checksum
-    ])
+    data = bytes(payload)
     
-    # Create output buffer
-    output = bytearray(4 + len(payload))
-    output[0:4] = header
-    output[4:] = payload
+    # Build header byte 0: retry (low 4 bits) | cmd_type (bits 4-6) | forward (bit 7)
+    byte0 = _header_byte(cmd_type, retry, forward)
     
     # Calculate checksum (sum of all bytes except byte 3, stored in byte 3)
-    checksum = 0
-    for i in range(len(output)):
-        if i != 3:  # Skip byte 3 itself
-            checksum += output[i]
-    
-    output[3] = checksum & 0xFF
+    checksum = byte0 + (seq & 0xFF) + (mesh_byte & 0xFF) + sum(data)
     
-    return bytes(output)
+    # Build 4-byte header and append the payload to it
+    return _pack_core(byte0, seq & 0xFF, mesh_byte & 0xFF, checksum & 0xFF, data, None, encrypt=False)
 
 
 def package_ble_fastcon_body(
@@ -54,8 +120,8 @@ def package_ble_fastcon_body(
     seq: int,           # param_3: Sequence number
     mesh_byte: int,     # param_4: Mesh byte
     forward: int,       # param_5: Forward flag (0 or 1)
-    payload: bytes,     # param_6: Payload data
-    mesh_key: bytes = None,  # param_9: 4-byte mesh key (or None for default)
+    payload: _Buffer,   # param_6: Payload data
+    mesh_key: Optional[_Buffer] = None,  # param_9: 4-byte mesh key (or None for default)
 ) -> bytes:
     """
     Creates encrypted control command.
@@ -69,56 +135,41 @@ def package_ble_fastcon_body(
     Returns 24 bytes for typical control commands.
     """
     # Build header byte 0
-    byte0 = (retry & 0x0F) | ((cmd_type & 0x07) << 4) | ((forward & 0x01) << 7)
+    byte0 = _header_byte(cmd_type, retry, forward)
     
-    # Build initial header
-    header = bytearray([
-        byte0,
-        seq & 0xFF,
-        mesh_byte & 0xFF,
-        0  # Placeholder for checksum
-    ])
-    
-    # Copy header and payload to output
-    output = bytearray(4 + len(payload))
-    output[0:4] = header
-    output[4:] = payload
+    return _package_ble_fastcon_body_fast(byte0, seq & 0xFF, mesh_byte & 0xFF, bytes(payload), _as_key(mesh_key))
+
+
+def _package_ble_fastcon_body_fast(
+    byte0: int,
+    seq: int,
+    mesh_byte: int,
+    payload: bytes,
+    mesh_key: Optional[bytes],
+) -> bytes:
+    """
+    package_ble_fastcon_body for arguments that are already in range.
     
+    byte0 comes from _header_byte() and seq / mesh_byte are 0-255, so none of
+    the masking is repeated here.
+    """
     # Calculate checksum (sum of all bytes except byte 3)
-    checksum = 0
-    for i in range(len(output)):
-        if i != 3:  # Skip byte 3 position
-            checksum += output[i]
-    
-    # XOR checksum with magic constant 0xc47b365e
-    # This modifies the 4-byte header
-    magic = 0xc47b365e
-    header_with_checksum = int.from_bytes(header, byteorder='little')
-    header_with_checksum = (header_with_checksum & 0xFFFFFF00) | (checksum & 0xFF)
-    header_with_checksum ^= magic
-    
-    # Write back modified header
-    output[0:4] = header_with_checksum.to_bytes(4, byteorder='little')
-    
-    # XOR payload with mesh key (if provided)
-    if mesh_key and len(mesh_key) >= 4:
-        payload_start = 4
-        payload_len = len(payload)
-        
-        for i in range(payload_len):
-            # XOR each payload byte with corresponding mesh key byte (cycling every 4 bytes)
-            output[payload_start + i] ^= mesh_key[i & 3]
-    
-    # Copy encrypted payload back
-    output[4:] = output[4:4+len(payload)]
-    
-    return bytes(output)
+    checksum = byte0 + seq + mesh_byte + sum(payload)
+    
+    # The checksum goes into the low byte of the little-endian header word
+    # (byte 0) and byte 3 stays 0, so it encodes to the magic byte itself.
+    # This is the layout the lights expect: byte0 is not sent, and the
+    # checksum is not in byte 3, whatever the field names suggest.
+    # Byte 0 changes with every payload, so there is no fixed prefix worth
+    # caching; an lru_cache over (seq, mesh_byte) for bytes 1-3 was slower
+    # than the XORs.
+    return _pack_core(checksum & 0xFF, seq, mesh_byte, 0, payload, mesh_key)
 
 
 def package_ble_fastcon_body_with_header(
-    header: bytes,      # param_1: 4-byte header (already built)
-    payload: bytes,     # param_2: Payload to encrypt
-    mesh_key: bytes = None,  # param_5: 4-byte mesh key
+    header: _Buffer,    # param_1: 4-byte header (already built)
+    payload: _Buffer,   # param_2: Payload to encrypt
+    mesh_key: Optional[_Buffer] = None,  # param_5: 4-byte mesh key
 ) -> bytes:
     """
     Encrypts header and payload.
@@ -128,32 +179,15 @@ def package_ble_fastcon_body_with_header(
     2. XOR payload with mesh key (repeating 4-byte pattern)
     3. Return encrypted command
     """
-    # Copy header and XOR with magic constant
-    output = bytearray(4 + len(payload))
-    magic_bytes = [0x5e, 0x36, 0x7b, 0xc4]
-    
-    for i in range(4):
-        output[i] = header[i] ^ magic_bytes[i]
-    
-    # Copy payload
-    encrypted_payload = bytearray(payload)
-    
-    # XOR payload with mesh key if provided
-    if mesh_key and len(mesh_key) >= 4:
-        for i in range(len(encrypted_payload)):
-            encrypted_payload[i] ^= mesh_key[i & 3]
-    
-    # Copy encrypted payload to output
-    output[4:] = encrypted_payload
-    
-    return bytes(output)
+    head = bytes(header)
+    return _pack_core(head[0], head[1], head[2], head[3], bytes(payload), _as_key(mesh_key))
 
 
 def create_control_command(
     address: int,
     cmd_type: int,
-    payload: bytes,
-    mesh_key: bytes,
+    payload: _Buffer,
+    mesh_key: Optional[_Buffer],
     seq: int = 0,
     retry: int = 0,
     forward: int = 0,
@@ -181,21 +215,19 @@ def create_control_command(
     Returns:
         Encrypted command bytes (typically 24 bytes)
     """
-    return package_ble_fastcon_body(
-        cmd_type=cmd_type,
-        retry=retry,
-        seq=seq,
-        mesh_byte=mesh_byte,
-        forward=forward,
-        payload=payload,
-        mesh_key=mesh_key,
+    return _package_ble_fastcon_body_fast(
+        _header_byte(cmd_type, retry, forward),
+        seq & 0xFF,
+        mesh_byte & 0xFF,
+        bytes(payload),
+        _as_key(mesh_key),
     )
 
 
 def decode_control_command(
-    encrypted: bytes,
-    mesh_key: bytes,
-) -> dict:
+    encrypted: _Buffer,
+    mesh_key: Optional[_Buffer],
+) -> Dict[str, Any]:
     """
     Decode encrypted control command.
     
@@ -208,29 +240,24 @@ def decode_control_command(
     """
     if len(encrypted) < 4:
         raise ValueError("Command too short (need at least 4 bytes)")
+    encrypted = bytes(encrypted)
     
-    # Decrypt header by XORing with magic constant
-    magic = 0xc47b365e
-    header_encrypted = int.from_bytes(encrypted[0:4], byteorder='little')
-    header_decrypted = header_encrypted ^ magic
-    header_bytes = header_decrypted.to_bytes(4, byteorder='little')
+    # Decrypt header by XORing with magic constant, byte by byte (no
+    # int.from_bytes round trip; every field is a single byte)
+    byte0 = encrypted[0] ^ _MAGIC[0]
     
     # Parse header
-    byte0 = header_bytes[0]
     retry = byte0 & 0x0F
     cmd_type = (byte0 >> 4) & 0x07
     forward = (byte0 >> 7) & 0x01
-    seq = header_bytes[1]
-    mesh_byte = header_bytes[2]
-    checksum = header_bytes[3]
-    
-    # Decrypt payload
-    payload_encrypted = encrypted[4:]
-    payload_decrypted = bytearray(payload_encrypted)
+    seq = encrypted[1] ^ _MAGIC[1]
+    mesh_byte = encrypted[2] ^ _MAGIC[2]
+    checksum = encrypted[3] ^ _MAGIC[3]
     
+    # Decrypt payload; _xor_with_key reads the slice as-is, no extra copy
+    payload = encrypted[4:]
     if mesh_key and len(mesh_key) >= 4:
-        for i in range(len(payload_decrypted)):
-            payload_decrypted[i] ^= mesh_key[i & 3]
+        payload = _xor_with_key(payload, bytes(mesh_key))
     
     return {
         'cmd_type': cmd_type,
@@ -239,7 +266,7 @@ def decode_control_command(
         'mesh_byte': mesh_byte,
         'forward': forward,
         'checksum': checksum,
-        'payload': bytes(payload_decrypted),
+        'payload': bytes(payload),
     }
 
 
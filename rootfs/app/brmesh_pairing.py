@@ -5,9 +5,21 @@ Based on reverse engineering of libbroadlink_ble.so
 
 The pairing "encryption" is actually just a structured message format.
 NO actual encryption is performed!
+
+Fully annotated so the add-on image can compile it with mypyc; the pure
+Python module is used as-is wherever the compiled extension is missing.
+Byte arguments may be bytes, bytearray or memoryview and are converted to
+bytes on entry, so both builds accept the same inputs and return bytes.
 """
+from typing import Final, Union
+
+# Byte buffers accepted by the packaging functions
+_Buffer = Union[bytes, bytearray, memoryview]
+
+# Zero padding after the group byte of the 18-byte response
+_DISC_RES2_PADDING: Final = bytes(5)
 
-def package_disc_res(device_id: bytes, address: int, constant: int, mesh_key: bytes) -> bytes:
+def package_disc_res(device_id: _Buffer, address: int, constant: int, mesh_key: _Buffer) -> bytes:
     """
     Create a pairing response for devices with address <= 256.
     
@@ -25,28 +37,15 @@ def package_disc_res(device_id: bytes, address: int, constant: int, mesh_key: by
     if len(mesh_key) != 4:
         raise ValueError(f"Mesh key must be 4 bytes, got {len(mesh_key)}")
     
-    response = bytearray(12)
-    
-    # Bytes 0-3: First 4 bytes of device ID
-    response[0:4] = device_id[0:4]
-    
-    # Bytes 4-5: Next 2 bytes of device ID
-    response[4:6] = device_id[4:6]
-    
-    # Byte 6: Device address (low byte)
-    response[6] = address & 0xFF
-    
-    # Byte 7: Constant (1 for pairing)
-    response[7] = constant & 0xFF
-    
+    # Bytes 0-5: Device ID
+    # Byte 6:    Device address (low byte)
+    # Byte 7:    Constant (1 for pairing)
     # Bytes 8-11: Mesh key (4 bytes)
-    response[8:12] = mesh_key[0:4]
-    
-    return bytes(response)
+    return bytes(device_id[0:6]) + bytes((address & 0xFF, constant & 0xFF)) + bytes(mesh_key[0:4])
 
 
-def package_disc_res2(device_id: bytes, address: int, group_id: int, constant: int, 
-                      mesh_key: bytes) -> bytes:
+def package_disc_res2(device_id: _Buffer, address: int, group_id: int, constant: int, 
+                      mesh_key: _Buffer) -> bytes:
     """
     Create a pairing response for devices with address > 256 or special types.
     
@@ -65,31 +64,16 @@ def package_disc_res2(device_id: bytes, address: int, group_id: int, constant: i
     if len(mesh_key) != 4:
         raise ValueError(f"Mesh key must be 4 bytes, got {len(mesh_key)}")
     
-    response = bytearray(18)
-    
-    # Bytes 0-3: First 4 bytes of device ID
-    response[0:4] = device_id[0:4]
-    
-    # Bytes 4-5: Next 2 bytes of device ID
-    response[4:6] = device_id[4:6]
-    
-    # Byte 6: Device address (low byte)
-    response[6] = address & 0xFF
-    
-    # Byte 7: Constant (1 for pairing)
-    response[7] = constant & 0xFF
-    
+    # Bytes 0-5: Device ID
+    # Byte 6:    Device address (low byte)
+    # Byte 7:    Constant (1 for pairing)
     # Bytes 8-11: Mesh key (4 bytes)
-    response[8:12] = mesh_key[0:4]
-    
-    # Byte 12: Group ID or high byte of address
-    response[12] = group_id & 0xFF
-    
+    # Byte 12:   Group ID or high byte of address
     # Bytes 13-17: Padding (zeros)
     # Note: Java code creates 18-byte array, decompiled shows 0xd (13) return
     # but the array size determines actual length
-    
-    return bytes(response)
+    return (bytes(device_id[0:6]) + bytes((address & 0xFF, constant & 0xFF)) + bytes(mesh_key[0:4])
+            + bytes((group_id & 0xFF,)) + _DISC_RES2_PADDING)
 
 
 def create_pairing_response(device_mac: str, address: int, group_id: int, 
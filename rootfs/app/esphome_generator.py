@@ -4,20 +4,183 @@ ESPHome Configuration Generator for BRMesh Controllers
 Generates YAML configs that Home Assistant can use as source of truth
 """
 import os
+import functools
+import hashlib
+import json
 import logging
-from typing import Dict, List
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from typing import Dict, List, Optional, Tuple, Union
 import yaml
 
+try:
+    # libyaml-backed emitter, roughly an order of magnitude faster
+    from yaml import CSafeDumper as _SafeDumper
+except ImportError:
+    # PyYAML built without libyaml
+    from yaml import SafeDumper as _SafeDumper
+
+
+class _Secret(str):
+    """Name of a secrets.yaml entry, dumped as a `!secret name` tag"""
+
+
+def _secret_representer(dumper, data):
+    """Emit the !secret tag itself rather than a quoted '!secret name' string"""
+    return dumper.represent_scalar('!secret', str(data), style='')
+
+
+class _ConfigDumper(_SafeDumper):
+    """Dumper for controller configs; keeps the !secret representer off the shared SafeDumper"""
+
+
+_ConfigDumper.add_representer(_Secret, _secret_representer)
+
 logger = logging.getLogger(__name__)
 
+# Bridge firmware version (independent of addon version)
+BRIDGE_FIRMWARE_VERSION = "1.1.0"
+
+# Comment lines that mark a config file as hand-maintained (never overwritten)
+_MANUAL_SENTINELS = (b"# manual_config: true", b"# manual_managed: true")
+
+# Placeholders dumped into the config skeleton and swapped for per-controller values
+_TOKEN_NAME = '__BRMESH_NAME__'
+_TOKEN_FRIENDLY_NAME = '__BRMESH_FRIENDLY_NAME__'
+_TOKEN_AP_SSID = '__BRMESH_AP_SSID__'
+_TOKEN_USE_ADDRESS = '__BRMESH_USE_ADDRESS__'
+_TOKEN_LIGHTS = '__BRMESH_LIGHTS__'
+_TOKEN_FIELDS = (
+    (_TOKEN_NAME, '{name}'),
+    (_TOKEN_FRIENDLY_NAME, '{friendly_name}'),
+    (_TOKEN_AP_SSID, '{ap_ssid}'),
+    (_TOKEN_USE_ADDRESS, '{use_address}'),
+)
+
+# Per-light YAML blocks, matching what yaml.dump emits for the equivalent dicts
+_LIGHT_TEMPLATE = (
+    "- platform: fastcon\n"
+    "  id: brmesh_light_{light_id:02d}\n"
+    "  name: {name}\n"
+    "  light_id: {light_id}\n"
+    "  color_interlock: {color_interlock}\n"
+    "{throttle}"
+    "{cwww}"
+)
+_PAIR_BUTTON_TEMPLATE = (
+    "- platform: template\n"
+    "  name: Pair Light {light_id}\n"
+    "  id: pair_light_id_{light_id}\n"
+    "  icon: mdi:link-plus\n"
+    "  on_press:\n"
+    "  - fastcon.pair_device:\n"
+    "      light_id: {light_id}\n"
+)
+_LIGHT_COMMENT_TEMPLATE = """
+# To add lights after pairing, uncomment and modify the template below:
+# - platform: fastcon
+#   id: brmesh_light_01
+#   name: "Living Room Light"
+#   light_id: 1
+#   color_interlock: true
+#   # supports_cwww: false  # Set to true for tunable white lights
+
+# Example: Add more lights by incrementing light_id
+# - platform: fastcon
+#   id: brmesh_light_02
+#   name: "Kitchen Light"
+#   light_id: 2
+#   color_interlock: true
+"""
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _yaml_scalar(value) -> str:
+    """Render a single value the way yaml.dump would inside a block mapping"""
+    text = yaml.dump(value, Dumper=_SafeDumper, default_flow_style=False, allow_unicode=True)
+    if text.endswith('\n...\n'):
+        text = text[:-4]
+    text = text.rstrip('\n')
+    if '\n' in text:
+        # Multi-line scalars can't be spliced in at an arbitrary indent;
+        # a JSON string is a valid single-line YAML double-quoted scalar
+        return json.dumps(value)
+    return text
+
+
+# Lowercase + space-to-dash in a single pass for ASCII controller names
+_SLUG_TABLE = str.maketrans({' ': '-', **{chr(c): chr(c + 32) for c in range(ord('A'), ord('Z') + 1)}})
+
+
+@functools.lru_cache(maxsize=256)
+def _slug(name: str) -> str:
+    """Controller name as used for the ESPHome node name and config filename"""
+    if name.isascii():
+        return name.translate(_SLUG_TABLE)
+    return name.lower().replace(' ', '-')
+
+
+def _config_digest(data: bytes) -> bytes:
+    """Short content digest used to detect unchanged config files"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
 class ESPHomeConfigGenerator:
+    # Controller config templates keyed by (use_optimized, with_domain). The
+    # skeleton doesn't depend on bridge state, so the cache is shared by every
+    # generator instance (the web UI recreates the generator on settings changes)
+    _templates: Dict[tuple, str] = {}
+    
     def __init__(self, bridge):
         self.bridge = bridge
         self.config_dir = "/config/esphome"
         
+        # Per config file: (generated digest, size, mtime_ns, status) as of the last
+        # time a sync wrote or inspected it
+        self._config_hashes: Dict[str, Tuple[bytes, int, int, str]] = {}
+        
+        # Bridge state digest and results of the last sync_configs run
+        self._last_state_hash: Optional[bytes] = None
+        self._last_results: Optional[Dict[str, Dict]] = None
+        
         # Create directory if it doesn't exist
         os.makedirs(self.config_dir, exist_ok=True)
     
+    def _atomic_write(self, path: str, content: Union[str, bytes]):
+        """Write a file via a temp file + rename so readers never see partial content"""
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        
+        # Encode once and write straight to the fd, bypassing buffered text I/O
+        data = memoryview(content.encode('utf-8') if isinstance(content, str) else content)
+        
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or self.config_dir,
+                                   prefix='.tmp-', suffix='.yaml')
+        try:
+            try:
+                os.fchmod(fd, mode)
+                while data:
+                    data = data[os.write(fd, data):]
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+    
+    def _remember_written(self, path: str, digest: bytes):
+        """Record a freshly written config so later syncs can skip re-reading it"""
+        st = os.stat(path)
+        self._config_hashes[path] = (digest, st.st_size, st.st_mtime_ns, 'skipped')
+    
     def _get_yaml_handler(self):
         """Get ruamel.yaml instance configured to preserve comments"""
         from ruamel.yaml import YAML
@@ -26,49 +189,32 @@ class ESPHomeConfigGenerator:
         yaml.default_flow_style = False
         return yaml
     
-    def generate_controller_config(self, controller: Dict, use_optimized: bool = True) -> str:
-        """Generate ESPHome YAML config for a controller
-        
-        In a mesh network, all controllers can control all lights,
-        so we include all lights in every controller config.
-        
-        Args:
-            controller: Controller configuration dictionary
-            use_optimized: Use optimized fork with command deduplication (default: True)
-        """
-        controller_name = controller['name'].lower().replace(' ', '-')
-        
+    def _build_config_skeleton(self, use_optimized: bool, with_domain: bool) -> Dict:
+        """Build the controller config dict with placeholder tokens for per-controller values"""
         # Base WiFi config with DHCP by default
         wifi_config = {
-            'ssid': '!secret wifi_ssid',
-            'password': '!secret wifi_password',
+            'ssid': _Secret('wifi_ssid'),
+            'password': _Secret('wifi_password'),
             'ap': {
-                'ssid': f'{controller_name.title()}-Fallback',
+                'ssid': _TOKEN_AP_SSID,
                 'password': 'brmesh123'
             }
         }
 
         # Add domain if configured
-        if self.bridge.config.get('wifi_domain'):
-            wifi_config['domain'] = '!secret wifi_domain'
-        
-        # Only add static IP if explicitly provided
-        if controller.get('ip_address'):
-            wifi_config['use_address'] = controller['ip_address']
-        else:
-            # Use mDNS hostname by default
-            wifi_config['use_address'] = f'{controller_name}.local'
+        if with_domain:
+            wifi_config['domain'] = _Secret('wifi_domain')
         
-        # Bridge firmware version (independent of addon version)
-        BRIDGE_FIRMWARE_VERSION = "1.1.0"
+        # Static IP if explicitly provided, otherwise the mDNS hostname
+        wifi_config['use_address'] = _TOKEN_USE_ADDRESS
         
         config = {
             'substitutions': {
                 'bridge_version': BRIDGE_FIRMWARE_VERSION
             },
             'esphome': {
-                'name': controller_name,
-                'friendly_name': controller['name'],
+                'name': _TOKEN_NAME,
+                'friendly_name': _TOKEN_FRIENDLY_NAME,
                 'comment': f'ESP BLE Bridge v{BRIDGE_FIRMWARE_VERSION}'
             },
             'esp32': {
@@ -82,12 +228,12 @@ class ESPHomeConfigGenerator:
             },
             'api': {
                 'encryption': {
-                    'key': '!secret api_encryption_key'
+                    'key': _Secret('api_encryption_key')
                 }
             },
             'ota': [{
                 'platform': 'esphome',
-                'password': '!secret ota_password'
+                'password': _Secret('ota_password')
             }],
             'wifi': wifi_config,
             'captive_portal': {},
@@ -206,74 +352,9 @@ if (!mfg_datas.empty()) {
         
         config['fastcon'] = {
             'id': 'fastcon_controller',
-            'mesh_key': '!secret mesh_key'
+            'mesh_key': _Secret('mesh_key')
         }
-        config['light'] = []
-        
-        # Add ALL lights - this is a mesh network after all!
-        # If no lights configured yet, add them from config
-        lights_to_add = []
-        
-        if use_optimized and not self.bridge.lights:
-            # Optimized mode starts with 0 lights - user pairs them manually
-            # Lights should be added to the config as they're paired
-            pass
-        elif self.bridge.lights:
-            # Use configured lights
-            for light_id, light in self.bridge.lights.items():
-                lights_to_add.append({
-                    'light_id': light_id,
-                    'name': light['name'],
-                    'color_interlock': light.get('color_interlock', True),
-                    'supports_cwww': light.get('supports_cwww', False)
-                })
-        else:
-            # Standard mode - no lights configured yet, add default count
-            num_lights = controller.get('num_lights', 15)  # Default to 15
-            for i in range(1, num_lights + 1):
-                lights_to_add.append({
-                    'light_id': i,
-                    'name': f'BRMesh Light {i:02d}',
-                    'color_interlock': True,
-                    'supports_cwww': False
-                })
-        
-        # Generate light configs
-        pairing_buttons = []
-        for light_data in lights_to_add:
-            light_id = light_data['light_id']
-            light_entity_id = f"brmesh_light_{light_id:02d}"
-            
-            light_config = {
-                'platform': 'fastcon',
-                'id': light_entity_id,
-                'name': light_data['name'],
-                'light_id': light_id,
-                'color_interlock': light_data['color_interlock']
-            }
-            
-            # Only add throttle in standard mode - optimized mode has it built-in
-            if not use_optimized:
-                light_config['throttle'] = '300ms'  # Prevent command queue overflow
-            
-            if light_data.get('supports_cwww'):
-                light_config['supports_cwww'] = True
-            
-            config['light'].append(light_config)
-            
-            # Add pairing button for this light (only in optimized mode)
-            if use_optimized:
-                pairing_buttons.append({
-                    'platform': 'template',
-                    'name': f"Pair Light {light_id}",
-                    'id': f"pair_light_id_{light_id}",
-                    'icon': 'mdi:link-plus',
-                    'on_press': [{
-                        'fastcon.pair_device': {
-                            'light_id': light_id
-                        }
-                    }]
-                })
+        config['light'] = _TOKEN_LIGHTS
         
         # Add monitoring sensors
         text_sensors = [
@@ -322,9 +403,6 @@ if (!mfg_datas.empty()) {
             }
         ]
         
-        if use_optimized:
-            buttons.extend(pairing_buttons)
-        
         config['binary_sensor'] = [
             {
                 'platform': 'status',
@@ -375,52 +453,139 @@ if (!mfg_datas.empty()) {
             ]
         
         config['text_sensor'] = text_sensors
+        # Pairing buttons are appended after the static buttons, so 'button' must stay last
         config['button'] = buttons
         
-        # Use PyYAML with custom representer that doesn't quote !secret tags
-        import yaml
-        from io import StringIO
+        return config
+    
+    def _controller_template(self, use_optimized: bool, with_domain: bool) -> str:
+        """Get the str.format template for a controller config, dumping the skeleton once"""
+        key = (use_optimized, with_domain)
+        template = self._templates.get(key)
+        if template is not None:
+            return template
+        
+        config = self._build_config_skeleton(use_optimized, with_domain)
+        
+        # Convert to YAML; _Secret values come out as !secret tags
+        yaml_output = yaml.dump(config, Dumper=_ConfigDumper, default_flow_style=False,
+                                sort_keys=False, allow_unicode=True)
+        
+        # Turn the dumped skeleton into a format string: escape literal braces
+        # (lambdas, empty mappings), then swap the tokens for named fields
+        template = yaml_output.replace('{', '{{').replace('}', '}}')
+        template = template.replace(f' {_TOKEN_LIGHTS}\n', '{lights}')
+        for token, field in _TOKEN_FIELDS:
+            template = template.replace(token, field)
+        template += '{pair_buttons}'
+        
+        self._templates[key] = template
+        return template
+    
+    def _lights_to_add(self, controller: Dict, use_optimized: bool) -> List[Dict]:
+        """Collect the lights to put in a controller config"""
+        # Add ALL lights - this is a mesh network after all!
+        # If no lights configured yet, add them from config
+        lights = self.bridge.lights
+        lights_to_add = []
         
-        # Custom representer for !secret tags
-        def secret_representer(dumper, data):
-            if isinstance(data, str) and data.startswith('!secret '):
-                # Return the tag without quotes
-                return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='')
-            return dumper.represent_str(data)
+        if use_optimized and not lights:
+            # Optimized mode starts with 0 lights - user pairs them manually
+            # Lights should be added to the config as they're paired
+            pass
+        elif lights:
+            # Use configured lights
+            for light_id, light in lights.items():
+                lights_to_add.append({
+                    'light_id': light_id,
+                    'name': light['name'],
+                    'color_interlock': light.get('color_interlock', True),
+                    'supports_cwww': light.get('supports_cwww', False)
+                })
+        else:
+            # Standard mode - no lights configured yet, add default count
+            num_lights = controller.get('num_lights', 15)  # Default to 15
+            for i in range(1, num_lights + 1):
+                lights_to_add.append({
+                    'light_id': i,
+                    'name': f'BRMesh Light {i:02d}',
+                    'color_interlock': True,
+                    'supports_cwww': False
+                })
         
-        # Register custom representer
-        yaml.add_representer(str, secret_representer)
+        return lights_to_add
+    
+    def _render_lights(self, lights_to_add: List[Dict], use_optimized: bool) -> Tuple[str, str]:
+        """Render the light list and pairing buttons YAML for a controller config"""
+        # Generate light configs (and a pairing button per light in optimized mode)
+        light_blocks = []
+        pairing_buttons = []
         
-        # Convert to YAML without quotes on !secret tags
-        yaml_output = yaml.dump(config, default_flow_style=False, sort_keys=False, allow_unicode=True)
+        # Only add throttle in standard mode - optimized mode has it built-in
+        throttle = '' if use_optimized else '  throttle: 300ms\n'  # Prevent command queue overflow
         
-        # Remove quotes around !secret tags that might still appear
-        import re
-        yaml_output = re.sub(r"'(!secret [^']+)'", r'\1', yaml_output)
-        yaml_output = re.sub(r'"(!secret [^"]+)"', r'\1', yaml_output)
+        for light_data in lights_to_add:
+            light_id = light_data['light_id']
+            color_interlock = light_data['color_interlock']
+            if type(color_interlock) is bool:
+                color_interlock = 'true' if color_interlock else 'false'
+            else:
+                color_interlock = _yaml_scalar(color_interlock)
+            light_blocks.append(_LIGHT_TEMPLATE.format(
+                light_id=light_id,
+                name=_yaml_scalar(light_data['name']),
+                color_interlock=color_interlock,
+                throttle=throttle,
+                cwww='  supports_cwww: true\n' if light_data.get('supports_cwww') else ''
+            ))
+            
+            if use_optimized:
+                pairing_buttons.append(_PAIR_BUTTON_TEMPLATE.format(light_id=light_id))
         
-        # Add helpful comment for optimized mode if no lights configured
-        if use_optimized and not lights_to_add:
-            light_template = """
-# To add lights after pairing, uncomment and modify the template below:
-# - platform: fastcon
-#   id: brmesh_light_01
-#   name: "Living Room Light"
-#   light_id: 1
-#   color_interlock: true
-#   # supports_cwww: false  # Set to true for tunable white lights
-
-# Example: Add more lights by incrementing light_id
-# - platform: fastcon
-#   id: brmesh_light_02
-#   name: "Kitchen Light"
-#   light_id: 2
-#   color_interlock: true
-"""
-            # Insert the template comment after the light: [] line
-            yaml_output = yaml_output.replace('light: []', 'light: []' + light_template)
+        if light_blocks:
+            lights_yaml = '\n' + ''.join(light_blocks)
+        elif use_optimized:
+            # Add helpful comment for optimized mode if no lights configured
+            lights_yaml = ' []' + _LIGHT_COMMENT_TEMPLATE + '\n'
+        else:
+            lights_yaml = ' []\n'
         
-        return yaml_output
+        return lights_yaml, ''.join(pairing_buttons)
+    
+    def generate_controller_config(self, controller: Dict, use_optimized: bool = True,
+                                   rendered_lights: Optional[Tuple[str, str]] = None) -> str:
+        """Generate ESPHome YAML config for a controller
+        
+        In a mesh network, all controllers can control all lights,
+        so we include all lights in every controller config.
+        
+        The static part of the document is dumped once per mode and reused as a
+        template; only the names, address and per-light blocks are formatted here.
+        
+        Args:
+            controller: Controller configuration dictionary
+            use_optimized: Use optimized fork with command deduplication (default: True)
+            rendered_lights: Pre-rendered (lights, pairing buttons) YAML shared by
+                all controllers, as built by generate_all_configs
+        """
+        controller_name = _slug(controller['name'])
+        
+        # Only use a static IP if explicitly provided, otherwise the mDNS hostname
+        use_address = controller.get('ip_address') or f'{controller_name}.local'
+        
+        if rendered_lights is None:
+            rendered_lights = self._render_lights(self._lights_to_add(controller, use_optimized), use_optimized)
+        lights_yaml, pair_buttons = rendered_lights
+        
+        template = self._controller_template(use_optimized, bool(self.bridge.config.get('wifi_domain')))
+        return template.format(
+            name=_yaml_scalar(controller_name),
+            friendly_name=_yaml_scalar(controller['name']),
+            ap_ssid=_yaml_scalar(f'{controller_name.title()}-Fallback'),
+            use_address=_yaml_scalar(use_address),
+            lights=lights_yaml,
+            pair_buttons=pair_buttons
+        )
     
     def generate_all_configs(self, force: bool = False) -> Dict[str, Dict]:
         """Generate configs for all controllers
@@ -444,67 +609,153 @@ if (!mfg_datas.empty()) {
         # Check if optimized mode is enabled (default: True)
         use_optimized = self.bridge.config.get('use_optimized_fork', True)
         
-        for controller in self.bridge.controllers:
-            controller_name = controller['name']
-            
-            # Generate config with ALL lights (mesh network!)
-            yaml_config = self.generate_controller_config(controller, use_optimized=use_optimized)
-            
-            # Save to file
-            filename = f"{controller_name.lower().replace(' ', '-')}.yaml"
-            filepath = os.path.join(self.config_dir, filename)
-            
-            result = {
-                'path': filepath,
-                'status': 'unknown'
-            }
-            
-            try:
-                # Check if file exists
-                if os.path.exists(filepath):
-                    with open(filepath, 'r') as f:
-                        existing_content = f.read()
-                    
-                    # Check for manual override flag
-                    if "# manual_config: true" in existing_content or "# manual_managed: true" in existing_content:
-                        logger.warning(f"⚠️  Skipping generation for {filename} due to manual_config flag")
-                        result['status'] = 'manual_override'
-                        results[controller_name] = result
-                        continue
-                    
-                    # Check if content is identical
-                    if existing_content == yaml_config:
-                        logger.debug(f"Config {filepath} is up to date")
-                        result['status'] = 'skipped'
-                        results[controller_name] = result
-                        continue
-                    
-                    # Content differs
-                    if force:
-                        logger.info(f"♻️  Updating ESPHome config: {filepath}")
-                        with open(filepath, 'w') as f:
-                            f.write(yaml_config)
-                        result['status'] = 'updated'
-                        result['content'] = yaml_config
-                    else:
-                        logger.info(f"ℹ️  Update available for {filepath} (not overwriting without force)")
-                        result['status'] = 'update_available'
-                        # Don't write, just report
-                else:
-                    logger.info(f"✨ Generated new ESPHome config: {filepath}")
-                    with open(filepath, 'w') as f:
-                        f.write(yaml_config)
-                    result['status'] = 'created'
+        # Configured lights are the same for every controller - render them once.
+        # Without configured lights the list only depends on each controller's
+        # num_lights, so render once per distinct count.
+        controllers = self.bridge.controllers
+        rendered_by_count: Dict[Optional[int], Tuple[str, str]] = {}
+        controller_lights = []
+        for controller in controllers:
+            if self.bridge.lights or use_optimized:
+                count = None
+            else:
+                count = controller.get('num_lights', 15)
+            rendered = rendered_by_count.get(count)
+            if rendered is None:
+                rendered = self._render_lights(self._lights_to_add(controller, use_optimized), use_optimized)
+                rendered_by_count[count] = rendered
+            controller_lights.append(rendered)
+        
+        # Stat every config file in one directory scan instead of per-controller calls
+        on_disk = {}
+        try:
+            with os.scandir(self.config_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.yaml'):
+                        try:
+                            on_disk[entry.name] = entry.stat()
+                        except OSError:
+                            pass
+        except FileNotFoundError:
+            pass
+        
+        # Build the shared template up front so worker threads only ever read it
+        self._controller_template(use_optimized, bool(self.bridge.config.get('wifi_domain')))
+        
+        # Controllers whose names slug to the same file must not race on it:
+        # each file's controllers run in order, like the old sequential loop
+        groups: Dict[str, List[int]] = {}
+        for index, controller in enumerate(controllers):
+            groups.setdefault(f"{_slug(controller['name'])}.yaml", []).append(index)
+        
+        def generate_group(filename, indices):
+            group_results = []
+            for position, index in enumerate(indices):
+                if position:
+                    # Later controllers see what the earlier ones wrote
+                    try:
+                        on_disk[filename] = os.stat(os.path.join(self.config_dir, filename))
+                    except FileNotFoundError:
+                        on_disk.pop(filename, None)
+                group_results.append(self._generate_one(controllers[index], use_optimized,
+                                                        controller_lights[index], on_disk, force))
+            return group_results
+        
+        controller_results: List[Optional[Dict]] = [None] * len(controllers)
+        if len(groups) < 2:
+            # Nothing to overlap - skip the thread pool setup
+            for filename, indices in groups.items():
+                for index, result in zip(indices, generate_group(filename, indices)):
+                    controller_results[index] = result
+        else:
+            # Files are independent; overlap their reads/writes/fsyncs
+            with ThreadPoolExecutor(max_workers=min(8, len(groups))) as executor:
+                group_results = executor.map(generate_group, groups.keys(), groups.values())
+                for indices, group_result in zip(groups.values(), group_results):
+                    for index, result in zip(indices, group_result):
+                        controller_results[index] = result
+        
+        for controller, result in zip(controllers, controller_results):
+            results[controller['name']] = result
+        
+        return results
+    
+    def _generate_one(self, controller: Dict, use_optimized: bool, rendered_lights: Tuple[str, str],
+                      on_disk: Dict[str, os.stat_result], force: bool) -> Dict:
+        """Generate and write (or check) the config file for a single controller"""
+        controller_name = controller['name']
+        
+        # Generate config with ALL lights (mesh network!)
+        yaml_config = self.generate_controller_config(controller, use_optimized=use_optimized,
+                                                      rendered_lights=rendered_lights)
+        config_bytes = yaml_config.encode('utf-8')
+        config_digest = _config_digest(config_bytes)
+        
+        # Save to file
+        filename = f"{_slug(controller_name)}.yaml"
+        filepath = os.path.join(self.config_dir, filename)
+        
+        result = {
+            'path': filepath,
+            'status': 'unknown'
+        }
+        
+        try:
+            # Check if file exists
+            st = on_disk.get(filename)
+            if st is not None:
+                # Neither the file nor the generated config changed since the last
+                # sync inspected it - reuse that outcome instead of re-reading
+                cached = self._config_hashes.get(filepath)
+                if (cached is not None and cached[:3] == (config_digest, st.st_size, st.st_mtime_ns)
+                        and not (force and cached[3] == 'update_available')):
+                    logger.debug(f"Config {filepath} unchanged since last check ({cached[3]})")
+                    result['status'] = cached[3]
+                    return result
+                
+                # Read raw bytes; the generated config is compared in its encoded form
+                with open(filepath, 'rb') as f:
+                    existing_content = f.read()
+                
+                # Check for manual override flag
+                if any(sentinel in existing_content for sentinel in _MANUAL_SENTINELS):
+                    logger.warning(f"⚠️  Skipping generation for {filename} due to manual_config flag")
+                    result['status'] = 'manual_override'
+                    self._config_hashes[filepath] = (config_digest, st.st_size, st.st_mtime_ns, 'manual_override')
+                    return result
+                
+                # Check if content is identical
+                if existing_content == config_bytes:
+                    logger.debug(f"Config {filepath} is up to date")
+                    self._config_hashes[filepath] = (config_digest, st.st_size, st.st_mtime_ns, 'skipped')
+                    result['status'] = 'skipped'
+                    return result
+                
+                # Content differs
+                if force:
+                    logger.info(f"♻️  Updating ESPHome config: {filepath}")
+                    self._atomic_write(filepath, config_bytes)
+                    self._remember_written(filepath, config_digest)
+                    result['status'] = 'updated'
                     result['content'] = yaml_config
+                else:
+                    logger.info(f"ℹ️  Update available for {filepath} (not overwriting without force)")
+                    result['status'] = 'update_available'
+                    self._config_hashes[filepath] = (config_digest, st.st_size, st.st_mtime_ns, 'update_available')
+                    # Don't write, just report
+            else:
+                logger.info(f"✨ Generated new ESPHome config: {filepath}")
+                self._atomic_write(filepath, config_bytes)
+                self._remember_written(filepath, config_digest)
+                result['status'] = 'created'
+                result['content'] = yaml_config
 
-            except Exception as e:
-                logger.error(f"Failed to write config {filepath}: {e}")
-                result['status'] = 'error'
-                result['error'] = str(e)
-            
-            results[controller_name] = result
+        except Exception as e:
+            logger.error(f"Failed to write config {filepath}: {e}")
+            result['status'] = 'error'
+            result['error'] = str(e)
         
-        return results
+        return result
     
     def generate_secrets_template(self) -> str:
         """Generate secrets.yaml template"""
@@ -517,7 +768,7 @@ if (!mfg_datas.empty()) {
             'ota_password': 'your_ota_password'
         }
         
-        return yaml.dump(secrets, default_flow_style=False)
+        return yaml.dump(secrets, Dumper=_SafeDumper, default_flow_style=False)
     
     def save_secrets_template(self):
         """Generate OTA/API secrets in /config/esphome/secrets.yaml if needed
@@ -554,8 +805,9 @@ if (!mfg_datas.empty()) {
                     'mesh_key': self.bridge.config.get('mesh_key', '30323336')
                 }
                 yaml_handler = self._get_yaml_handler()
-                with open(ha_secrets_path, 'w') as f:
-                    yaml_handler.dump(secrets, f)
+                buf = StringIO()
+                yaml_handler.dump(secrets, buf)
+                self._atomic_write(ha_secrets_path, buf.getvalue())
                 logger.info(f"✅ Created /config/secrets.yaml with generated keys")
                 logger.info(f"🔑 API key length: {len(api_key)}, valid base64: {self._is_valid_base64_key(api_key)}")
             except Exception as e:
@@ -631,8 +883,9 @@ if (!mfg_datas.empty()) {
                             # Create new file with all secrets
                             secrets.update(keys_to_update)
                             yaml_handler = self._get_yaml_handler()
-                            with open(esphome_secrets_path, 'w') as f:
-                                yaml_handler.dump(secrets, f)
+                            buf = StringIO()
+                            yaml_handler.dump(secrets, buf)
+                            self._atomic_write(esphome_secrets_path, buf.getvalue())
                             logger.info(f"✅ Created /config/esphome/secrets.yaml")
                     except Exception as copy_error:
                         logger.error(f"Failed to update esphome secrets: {copy_error}")
@@ -666,17 +919,49 @@ if (!mfg_datas.empty()) {
         alphabet = string.ascii_letters + string.digits
         return ''.join(secrets.choice(alphabet) for _ in range(16))
     
+    def _sync_state_hash(self) -> bytes:
+        """Digest of the bridge state that the generated configs depend on"""
+        config = self.bridge.config
+        state = (
+            self.bridge.config_epoch,
+            config.get('use_optimized_fork', True),
+            bool(config.get('wifi_domain')),
+            [(c['name'], c.get('ip_address'), c.get('num_lights')) for c in self.bridge.controllers],
+            [(light_id, light['name'], light.get('color_interlock', True), light.get('supports_cwww', False))
+             for light_id, light in self.bridge.lights.items()],
+        )
+        return _config_digest(repr(state).encode('utf-8'))
+    
     def sync_configs(self):
         """Main entry point - generate all configs"""
         if not self.bridge.config.get('generate_esphome_configs', True):
             logger.info("ESPHome config generation disabled")
             return
         
+        # Nothing changed since the last sync and its files are still there
+        state_hash = self._sync_state_hash()
+        if (state_hash == self._last_state_hash and self._last_results is not None
+                and all(os.path.exists(r['path']) for r in self._last_results.values())):
+            logger.debug("ESPHome configurations unchanged since last sync")
+            # Secrets can be deleted or invalidated independently of the bridge
+            # state, so they are still checked on every sync
+            self.save_secrets_template()
+            return self._last_results
+        
         logger.info("Checking ESPHome configurations...")
         # Default to force=False to prevent overwriting existing configs on startup
         results = self.generate_all_configs(force=False)
         self.save_secrets_template()
         
+        # Only remember settled results - errors and pending updates are
+        # rechecked on the next sync
+        if any(r['status'] in ('error', 'update_available') for r in results.values()):
+            self._last_state_hash = None
+            self._last_results = None
+        else:
+            self._last_state_hash = state_hash
+            self._last_results = results
+        
         updated = sum(1 for r in results.values() if r['status'] in ['created', 'updated'])
         available = sum(1 for r in results.values() if r['status'] == 'update_available')
         
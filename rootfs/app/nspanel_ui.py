@@ -31,6 +31,13 @@ class NSPanelUIGenerator:
             'off': 0x7BEF,             # Light gray
             'on': 0xFFE0               # Yellow
         }
+        
+        # Card command templates with the fixed palette colors baked in
+        text_color = self.colors['text']
+        self._fill_tmpl = 'fill {x},{y},{w},{h},{bg}'.format
+        self._draw_tmpl = ('draw {x},{y},{x2},{y2},' + str(text_color)).format
+        self._card_text_tmpl = ('xstr {x},{y},{w},20,0,' + str(text_color) + ',{bg},1,1,1,"{name}"').format
+        self._card_id_tmpl = ('xstr {x},{y},{w},12,0,' + str(self.colors['off']) + ',{bg},0,1,1,"ID: {light_id}"').format
     
     def generate_page_layout(self) -> List[str]:
         """
@@ -90,8 +97,8 @@ class NSPanelUIGenerator:
         
         # Card background
         bg_color = self.colors['on'] if is_on else self.colors['card_bg']
-        commands.append(f"fill {x},{y},{w},{h},{bg_color}")
-        commands.append(f"draw {x},{y},{x+w},{y+h},{self.colors['text']}")
+        commands.append(self._fill_tmpl(x=x, y=y, w=w, h=h, bg=bg_color))
+        commands.append(self._draw_tmpl(x=x, y=y, x2=x+w, y2=y+h))
         
         # Light icon
         icon_x = x + w // 2 - 15
@@ -103,11 +110,11 @@ class NSPanelUIGenerator:
         
         # Light name
         text_y = y + h - 35
-        commands.append(f'xstr {x+5},{text_y},{w-10},20,0,{self.colors["text"]},{bg_color},1,1,1,"{name}"')
+        commands.append(self._card_text_tmpl(x=x+5, y=text_y, w=w-10, bg=bg_color, name=name))
         
         # ID label (smaller)
         id_y = y + h - 15
-        commands.append(f'xstr {x+5},{id_y},{w-10},12,0,{self.colors["off"]},{bg_color},0,1,1,"ID: {light_id}"')
+        commands.append(self._card_id_tmpl(x=x+5, y=id_y, w=w-10, bg=bg_color, light_id=light_id))
         
         # Touch hotspot for toggling
         commands.append(f"// Touch area for light {light_id}: {x},{y},{w},{h}")
@@ -11,7 +11,7 @@ import os
 import requests
 from PIL import Image
 from io import BytesIO
-from esphome_generator import ESPHomeConfigGenerator
+from esphome_generator import ESPHomeConfigGenerator, BRIDGE_FIRMWARE_VERSION
 from brmesh_pairing import create_pairing_response
 from brmesh_control import create_control_command, decode_control_command
 
@@ -653,18 +653,8 @@ class WebUI:
                 except:
                     pass
                 
-                # Get expected firmware version from generator
-                expected_version = "1.0.0"  # Default
-                if self.bridge.esphome_generator:
-                    try:
-                        # Extract version from generator constant
-                        import inspect
-                        source = inspect.getsource(self.bridge.esphome_generator.generate_controller_config)
-                        match = re.search(r'BRIDGE_FIRMWARE_VERSION = "([\d.]+)"', source)
-                        if match:
-                            expected_version = match.group(1)
-                    except:
-                        pass
+                # Expected firmware version comes from the generator constant
+                expected_version = BRIDGE_FIRMWARE_VERSION
                 
                 return jsonify({
                     'name': controller_name,
@@ -34,6 +34,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# BRMesh manufacturer ID in either byte order (0xfff0 == 65520, 0xf0ff == 61695)
+BRMESH_MFR_IDS = frozenset({0xfff0, 0xf0ff})
+
 class BRMeshSecurityScanner:
     """
     Passive BLE scanner that extracts mesh keys from BRMesh traffic
@@ -65,7 +68,7 @@ class BRMeshSecurityScanner:
             
             for mfr_id, data in advertisement_data.manufacturer_data.items():
                 # BRMesh uses 0xfff0 (may appear as 61695 or 0xf0ff depending on endianness)
-                if mfr_id not in [0xfff0, 0xf0ff, 61695, 65520]:
+                if mfr_id not in BRMESH_MFR_IDS:
                     continue
                 
                 mac = device.address
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Schema lock for the templated controller config.
+
+generate_controller_config formats a pre-dumped skeleton instead of calling
+yaml.dump per controller. These tests build the same config as a dict (the
+way the generator used to) and check both load to identical structures.
+"""
+import copy
+import os
+import sys
+
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'rootfs', 'app'))
+import esphome_generator as eg  # noqa: E402
+
+
+class _SecretLoader(yaml.SafeLoader):
+    """SafeLoader that keeps !secret references as comparable values"""
+
+
+_SecretLoader.add_constructor('!secret', lambda loader, node: f'<secret {loader.construct_scalar(node)}>')
+
+NAMES = [
+    'BRMesh Bridge',
+    "Kit'chen: \"main\"",
+    'Braces {0} and {name}',
+    'Wohnzimmer Lámpara 客厅',
+    '- dash: # hash',
+    'yes',
+]
+
+
+class _Bridge:
+    def __init__(self, lights, config, controllers):
+        self.lights = lights
+        self.config = config
+        self.controllers = controllers
+
+
+def _generator(lights, config):
+    generator = eg.ESPHomeConfigGenerator.__new__(eg.ESPHomeConfigGenerator)
+    generator.bridge = _Bridge(lights, config, [])
+    return generator
+
+
+def _replace_tokens(node, values):
+    if isinstance(node, eg._Secret):
+        return f'<secret {node}>'
+    if isinstance(node, str):
+        return values.get(node, node)
+    if isinstance(node, dict):
+        return {key: _replace_tokens(value, values) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_replace_tokens(value, values) for value in node]
+    return node
+
+
+def _expected_config(generator, controller, use_optimized):
+    """The controller config as a plain dict, as yaml.dump used to receive it"""
+    with_domain = bool(generator.bridge.config.get('wifi_domain'))
+    skeleton = copy.deepcopy(generator._build_config_skeleton(use_optimized, with_domain))
+
+    controller_name = eg._slug(controller['name'])
+    lights = []
+    pairing_buttons = []
+    for light_data in generator._lights_to_add(controller, use_optimized):
+        light_id = light_data['light_id']
+        light_config = {
+            'platform': 'fastcon',
+            'id': f"brmesh_light_{light_id:02d}",
+            'name': light_data['name'],
+            'light_id': light_id,
+            'color_interlock': light_data['color_interlock'],
+        }
+        if not use_optimized:
+            light_config['throttle'] = '300ms'
+        if light_data.get('supports_cwww'):
+            light_config['supports_cwww'] = True
+        lights.append(light_config)
+
+        if use_optimized:
+            pairing_buttons.append({
+                'platform': 'template',
+                'name': f"Pair Light {light_id}",
+                'id': f"pair_light_id_{light_id}",
+                'icon': 'mdi:link-plus',
+                'on_press': [{'fastcon.pair_device': {'light_id': light_id}}],
+            })
+
+    config = _replace_tokens(skeleton, {
+        eg._TOKEN_NAME: controller_name,
+        eg._TOKEN_FRIENDLY_NAME: controller['name'],
+        eg._TOKEN_AP_SSID: f'{controller_name.title()}-Fallback',
+        eg._TOKEN_USE_ADDRESS: controller.get('ip_address') or f'{controller_name}.local',
+    })
+    config['light'] = lights
+    config['button'] = config['button'] + pairing_buttons
+    return config
+
+
+@pytest.mark.parametrize('use_optimized', [True, False])
+@pytest.mark.parametrize('bridge_config', [{}, {'wifi_domain': 'lan'}])
+@pytest.mark.parametrize('with_lights', [False, True])
+@pytest.mark.parametrize('name', NAMES)
+def test_template_matches_dumped_structure(name, with_lights, bridge_config, use_optimized):
+    lights = {}
+    if with_lights:
+        lights = {
+            1: {'name': name, 'color_interlock': True, 'supports_cwww': False},
+            2: {'name': 'Kitchen {x}: "1"', 'color_interlock': False, 'supports_cwww': True},
+            3: {'name': 'Ünïcode 💡'},
+        }
+    generator = _generator(lights, bridge_config)
+
+    for controller in ({'name': name}, {'name': name, 'ip_address': '192.168.1.50', 'num_lights': 3}):
+        generated = generator.generate_controller_config(controller, use_optimized=use_optimized)
+        loaded = yaml.load(generated, Loader=_SecretLoader)
+        expected = _expected_config(generator, controller, use_optimized)
+
+        assert loaded == expected
+        assert loaded == yaml.load(yaml.dump(expected, allow_unicode=True, sort_keys=False), Loader=_SecretLoader)
+        assert list(loaded) == list(expected)
+
+
+def test_secret_values_are_tags():
+    generated = _generator({}, {'wifi_domain': 'lan'}).generate_controller_config({'name': 'Bridge'})
+
+    assert 'ssid: !secret wifi_ssid' in generated
+    assert 'domain: !secret wifi_domain' in generated
+    assert "'!secret" not in generated